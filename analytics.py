@@ -0,0 +1,187 @@
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+
+import archive
+
+IST = timezone(timedelta(hours=5, minutes=30))
+
+AGE_BANDS = (('<20', 0, 20), ('20-39', 20, 40), ('40-59', 40, 60), ('60+', 60, 200))
+GENDERS = ('Male', 'Female', 'Other', 'Unknown')
+BMI_BIN_EDGES = np.arange(10.0, 52.0, 2.0)
+PERCENTILES = (5, 25, 50, 75, 95)
+
+def init_analytics_tables(cursor):
+    # Daily rollups are maintained incrementally in the same transaction as each insert
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_daily_categories (
+            day TEXT NOT NULL,
+            category TEXT NOT NULL,
+            readings INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, category)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_daily_revenue (
+            day TEXT PRIMARY KEY,
+            invoices INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('SELECT EXISTS (SELECT 1 FROM analytics_daily_categories)')
+    if not cursor.fetchone()[0]:
+        rebuild_rollups(cursor)
+
+def ist_day(epoch_ms):
+    return datetime.fromtimestamp(epoch_ms / 1000, IST).strftime('%Y-%m-%d')
+
+def record_bmi(db, category, epoch_ms):
+    db.execute('''
+        INSERT INTO analytics_daily_categories (day, category, readings) VALUES (?, ?, 1)
+        ON CONFLICT (day, category) DO UPDATE SET readings = readings + 1
+    ''', (ist_day(epoch_ms), category))
+
+def record_invoice(db, total_amount, epoch_ms):
+    db.execute('''
+        INSERT INTO analytics_daily_revenue (day, invoices, revenue) VALUES (?, 1, ?)
+        ON CONFLICT (day) DO UPDATE SET invoices = invoices + 1, revenue = revenue + excluded.revenue
+    ''', (ist_day(epoch_ms), total_amount))
+
+def rebuild_rollups(db):
+    # Attach the shard's archive first, or the archived history drops out of the rollups
+    readings = archive.with_archive(db, 'bmi_records', 'date_ms, category')
+    invoices = archive.with_archive(db, 'invoices', 'invoice_date_ms, total_amount')
+    db.execute('DELETE FROM analytics_daily_categories')
+    db.execute('DELETE FROM analytics_daily_revenue')
+    db.execute(f'''
+        INSERT INTO analytics_daily_categories (day, category, readings)
+        SELECT date(date_ms / 1000, 'unixepoch', '+330 minutes'), category, COUNT(*)
+        FROM {readings} WHERE date_ms IS NOT NULL GROUP BY 1, 2
+    ''')
+    db.execute(f'''
+        INSERT INTO analytics_daily_revenue (day, invoices, revenue)
+        SELECT date(invoice_date_ms / 1000, 'unixepoch', '+330 minutes'), COUNT(*), SUM(total_amount)
+        FROM {invoices} WHERE invoice_date_ms IS NOT NULL GROUP BY 1
+    ''')
+
+def category_mix_by_week(db, weeks):
+    since = datetime.now(IST).date() - timedelta(weeks=weeks)
+    rows = db.execute(
+        'SELECT day, category, readings FROM analytics_daily_categories WHERE day >= ? ORDER BY day',
+        (since.isoformat(),)
+    ).fetchall()
+    by_week = {}
+    for day, category, readings in rows:
+        day = date.fromisoformat(day)
+        week_start = (day - timedelta(days=day.weekday())).isoformat()
+        counts = by_week.setdefault(week_start, {})
+        counts[category] = counts.get(category, 0) + readings
+    return [{'week_start': week, 'counts': counts} for week, counts in sorted(by_week.items())]
+
+def revenue_by_day(db, days):
+    since = datetime.now(IST).date() - timedelta(days=days)
+    rows = db.execute(
+        'SELECT day, invoices, revenue FROM analytics_daily_revenue WHERE day >= ? ORDER BY day',
+        (since.isoformat(),)
+    ).fetchall()
+    return [{'day': day, 'invoices': invoices, 'revenue': round(revenue, 2)} for day, invoices, revenue in rows]
+
+def load_snapshot(db):
+    # Column snapshot of every reading, archived ones included when the archive is attached;
+    # histograms and percentiles run over these arrays
+    rows = db.execute(f"SELECT bmi, age, gender FROM {archive.with_archive(db, 'bmi_records', 'bmi, age, gender')}").fetchall()
+    count = len(rows)
+    bmi = np.fromiter((row[0] for row in rows), dtype=np.float64, count=count)
+    age = np.fromiter((row[1] if row[1] is not None else np.nan for row in rows), dtype=np.float64, count=count)
+    gender_codes = {name.lower(): code for code, name in enumerate(GENDERS)}
+    gender = np.fromiter(
+        (gender_codes.get(str(row[2] or '').strip().lower(), len(GENDERS) - 1) for row in rows),
+        dtype=np.int8, count=count
+    )
+    return bmi, age, gender
+
+def bmi_histograms(snapshot):
+    bmi, age, gender = snapshot
+    clipped = np.clip(bmi, BMI_BIN_EDGES[0], BMI_BIN_EDGES[-1] - 1e-9)
+    groups = []
+    for band, low, high in AGE_BANDS:
+        in_band = (age >= low) & (age < high)
+        for code, name in enumerate(GENDERS):
+            mask = in_band & (gender == code)
+            count = int(mask.sum())
+            if not count:
+                continue
+            histogram, _ = np.histogram(clipped[mask], bins=BMI_BIN_EDGES)
+            values = np.percentile(bmi[mask], PERCENTILES)
+            groups.append({
+                'age_band': band,
+                'gender': name,
+                'count': count,
+                'histogram': histogram.tolist(),
+                'percentiles': {f'p{p}': round(float(v), 2) for p, v in zip(PERCENTILES, values)}
+            })
+    return {
+        'bin_edges': BMI_BIN_EDGES.tolist(),
+        'readings': int(bmi.size),
+        'unknown_age': int(np.isnan(age).sum()),
+        'groups': groups
+    }
+
+def shard_report(db, weeks=12, days=30):
+    # The part of the report one database (shard) contributes; build_report merges them
+    return category_mix_by_week(db, weeks), revenue_by_day(db, days), load_snapshot(db)
+
+def merge_category_mix(mixes):
+    by_week = {}
+    for mix in mixes:
+        for entry in mix:
+            counts = by_week.setdefault(entry['week_start'], {})
+            for category, readings in entry['counts'].items():
+                counts[category] = counts.get(category, 0) + readings
+    return [{'week_start': week, 'counts': counts} for week, counts in sorted(by_week.items())]
+
+def merge_revenue(revenues):
+    by_day = {}
+    for revenue in revenues:
+        for entry in revenue:
+            invoices, total = by_day.get(entry['day'], (0, 0.0))
+            by_day[entry['day']] = (invoices + entry['invoices'], total + entry['revenue'])
+    return [{'day': day, 'invoices': invoices, 'revenue': round(total, 2)} for day, (invoices, total) in sorted(by_day.items())]
+
+def build_report(parts):
+    mixes, revenues, snapshots = zip(*parts)
+    snapshot = tuple(np.concatenate(columns) for columns in zip(*snapshots))
+    return {
+        'success': True,
+        'generated_at': datetime.now(IST).strftime('%Y-%m-%d %H:%M:%S'),
+        'category_mix_by_week': merge_category_mix(mixes),
+        'revenue_by_day': merge_revenue(revenues),
+        'bmi_histograms': bmi_histograms(snapshot)
+    }
+
+class ResponseCache:
+    # Small TTL cache for serialised reports, keyed by the query parameters
+    def __init__(self, ttl_seconds):
+        self.ttl = ttl_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+        body = json.dumps(build())
+        with self._lock:
+            self._entries[key] = (now + self.ttl, body)
+            for stale in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+                del self._entries[stale]
+        return body
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -5,15 +5,40 @@ import secrets
 import traceback
 import io
 import smtplib
+import calendar
+import itertools
+from xml.sax.saxutils import escape as xml_escape
+import time
+import click
 from datetime import datetime, timedelta, timezone
 from functools import wraps
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file, send_from_directory, get_template_attribute, g
 from dotenv import load_dotenv
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
 from email import encoders
+from write_queue import GroupCommitWriter
+from passwords import hash_password, verify_password, needs_rehash, HashingBusy
+import analytics
+import history
+import archive
+import backup
+import shards
+import metrics
+import ratelimit
+import speculation
+import invoice_report
+import fragments
+import assets
+import compression
+import campaign
+import reset_tokens
+import memprofile
+import signal
+from concurrent.futures import ThreadPoolExecutor
+import mimetypes
+from bmi_classifier import classify, HEALTH_ADVICE
 
 # ReportLab Imports
 from reportlab.lib.pagesizes import A4, letter
@@ -32,6 +57,9 @@ app.secret_key = 'bmi-health-tracker-secret-key-123'
 # Get the absolute path of the project directory
 basedir = os.path.abspath(os.path.dirname(__file__))
 DATABASE = os.path.join(basedir, 'database.db')
+# Patients are spread over this many SQLite files (database.db, database.shard1.db, ...);
+# change it together with `flask split-shards`
+DB_SHARDS = max(int(os.environ.get('DB_SHARDS', 1)), 1)
 IST = timezone(timedelta(hours=5, minutes=30))
 
 # Absolute path for PDF storage
@@ -39,41 +67,313 @@ TEMP_PDF_DIR = os.path.join(basedir, 'temp_pdfs')
 if not os.path.exists(TEMP_PDF_DIR):
     os.makedirs(TEMP_PDF_DIR)
 
+# Minified, fingerprinted and precompressed copies of static CSS/JS (see assets.py), built at startup
+# or with `flask build-assets`. Templates keep using url_for('static', ...) and get the hashed name.
+ASSET_PIPELINE = os.environ.get('ASSET_PIPELINE', '1') == '1'
+ASSET_DIST_DIR = os.path.join(basedir, 'static', 'dist')
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+asset_manifest = {}
+if ASSET_PIPELINE:
+    try:
+        asset_manifest = assets.build_assets(app.static_folder, ASSET_DIST_DIR)
+    except OSError as e:
+        print(f"DEBUG: Asset build failed, serving static files unprocessed: {e}")
+
+# Negotiated gzip/brotli for dynamic HTML and JSON (see compression.py); files from send_file and
+# /static/dist/ are left alone. Small bodies are not worth the CPU or the extra header bytes.
+COMPRESSION = os.environ.get('COMPRESSION', '1') == '1'
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '500'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_LEVEL = int(os.environ.get('COMPRESSION_BROTLI_LEVEL', '4'))
+
+@app.url_defaults
+def fingerprint_static(endpoint, values):
+    if endpoint == 'static' and values.get('filename') in asset_manifest:
+        values['filename'] = 'dist/' + asset_manifest[values['filename']]
+
+# How finished PDFs leave the process: 'flask' streams through the worker (wsgi.file_wrapper,
+# which gunicorn implements with os.sendfile), 'nginx' emits X-Accel-Redirect, 'apache' emits X-Sendfile
+PDF_DELIVERY = os.environ.get('PDF_DELIVERY', 'flask').lower()
+NGINX_PDF_PREFIX = os.environ.get('NGINX_PDF_PREFIX', '/protected-pdfs/')
+# Rendered invoice PDFs stay in TEMP_PDF_DIR for repeat downloads. After each new render and in
+# `flask archive-old-records`, files unused for INVOICE_PDF_CACHE_DAYS are deleted, then the least
+# recently used ones until the rest fit in INVOICE_PDF_CACHE_MB.
+INVOICE_PDF_CACHE_DAYS = float(os.environ.get('INVOICE_PDF_CACHE_DAYS', 30))
+INVOICE_PDF_CACHE_MB = float(os.environ.get('INVOICE_PDF_CACHE_MB', 256))
+app.config['USE_X_SENDFILE'] = PDF_DELIVERY == 'apache'
+
+# Optional write-behind group commit for /bmi inserts (see write_queue.py)
+BMI_GROUP_COMMIT = os.environ.get('BMI_GROUP_COMMIT', '0') == '1'
+BMI_GROUP_COMMIT_ROWS = int(os.environ.get('BMI_GROUP_COMMIT_ROWS', 64))
+BMI_GROUP_COMMIT_MS = float(os.environ.get('BMI_GROUP_COMMIT_MS', 5))
+BMI_GROUP_COMMIT_SYNC = os.environ.get('BMI_GROUP_COMMIT_SYNC', 'FULL')
+
+# Clinic-wide endpoints are restricted to these accounts
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()}
+ANALYTICS_CACHE_SECONDS = int(os.environ.get('ANALYTICS_CACHE_SECONDS', 60))
+analytics_cache = analytics.ResponseCache(ANALYTICS_CACHE_SECONDS)
+
+# Readings older than the retention window are moved here by `flask archive-old-records`
+ARCHIVE_DATABASE = os.environ.get('ARCHIVE_DATABASE') or os.path.join(basedir, 'archive.db')
+ARCHIVE_RETENTION_DAYS = int(os.environ.get('ARCHIVE_RETENTION_DAYS', 365))
+
+# Outgoing mail. Defaults are Gmail over SSL; point these at a local SMTP stand-in
+# (SMTP_SSL=0) to try `flask send-campaign` without sending real mail
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 465))
+SMTP_SSL = os.environ.get('SMTP_SSL', '1') == '1'
+
+# Online backups (SQLite backup API) and the read-only snapshot used by reporting jobs
+BACKUP_DIR = os.environ.get('BACKUP_DIR') or os.path.join(basedir, 'backups')
+SNAPSHOT_DATABASE = os.environ.get('SNAPSHOT_DATABASE') or os.path.join(BACKUP_DIR, 'snapshot.db')
+BACKUP_INTERVAL_MINUTES = int(os.environ.get('BACKUP_INTERVAL_MINUTES', 0))
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 7))
+BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', 256))
+ANALYTICS_USE_SNAPSHOT = os.environ.get('ANALYTICS_USE_SNAPSHOT', '0') == '1'
+
+# Token buckets ('count/seconds', '0' disables) and concurrent slots for routes that render PDFs
+# or talk to SMTP. 'memory' keeps buckets per worker, 'sqlite' shares them through RATE_LIMIT_DATABASE.
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory').lower()
+RATE_LIMIT_DATABASE = os.environ.get('RATE_LIMIT_DATABASE') or os.path.join(basedir, 'ratelimit.db')
+RATE_LIMITS = {
+    'pdf': {
+        'user': ratelimit.parse_rate(os.environ.get('RATE_LIMIT_PDF_USER', '10/60')),
+        'global': ratelimit.parse_rate(os.environ.get('RATE_LIMIT_PDF_GLOBAL', '120/60')),
+        'concurrency': int(os.environ.get('RATE_LIMIT_PDF_CONCURRENCY', 4))
+    },
+    'email': {
+        'user': ratelimit.parse_rate(os.environ.get('RATE_LIMIT_EMAIL_USER', '5/300')),
+        'global': ratelimit.parse_rate(os.environ.get('RATE_LIMIT_EMAIL_GLOBAL', '60/60')),
+        'concurrency': int(os.environ.get('RATE_LIMIT_EMAIL_CONCURRENCY', 4))
+    },
+    # Keyed by the requested email address, whether or not an account exists for it
+    'reset': {
+        'user': ratelimit.parse_rate(os.environ.get('RATE_LIMIT_RESET_ACCOUNT', '3/900')),
+        'global': ratelimit.parse_rate(os.environ.get('RATE_LIMIT_RESET_GLOBAL', '30/60'))
+    }
+}
+
+# Opt-in memory profiling (see memprofile.py). MEMORY_PROFILING=1 turns on tracemalloc, which
+# slows allocation-heavy code, so enable it on one canary worker. RSS accounting around PDF
+# renders and the MEMORY_CEILING_MB recycling check are cheap and always available.
+MEMORY_PROFILING = os.environ.get('MEMORY_PROFILING', '0') == '1'
+MEMORY_PROFILE_SAMPLE_RATE = float(os.environ.get('MEMORY_PROFILE_SAMPLE_RATE', 0.01))
+MEMORY_PROFILE_TOP = int(os.environ.get('MEMORY_PROFILE_TOP', 10))
+MEMORY_PROFILE_FRAMES = int(os.environ.get('MEMORY_PROFILE_FRAMES', 1))
+MEMORY_PROFILE_DIR = os.environ.get('MEMORY_PROFILE_DIR') or os.path.join(basedir, 'memprofiles')
+MEMORY_PROFILE_SIGNAL = getattr(signal, os.environ.get('MEMORY_PROFILE_SIGNAL', 'SIGUSR2'), None)
+MEMORY_CEILING_MB = int(os.environ.get('MEMORY_CEILING_MB', 0))
+
+memory_profiler = memprofile.MemoryProfiler(
+    enabled=MEMORY_PROFILING,
+    sample_rate=MEMORY_PROFILE_SAMPLE_RATE,
+    top=MEMORY_PROFILE_TOP,
+    frames=MEMORY_PROFILE_FRAMES,
+    dump_dir=MEMORY_PROFILE_DIR,
+    ceiling_bytes=MEMORY_CEILING_MB * 1048576
+)
+memory_profiler.start()
+memory_profiler.install_signal_handler(MEMORY_PROFILE_SIGNAL)
+
+# Password reset links. APP_BASE_URL (e.g. https://clinic.example.com) is used for the link
+# when set, so it never depends on the Host header of the request that asked for it.
+PASSWORD_RESET_TTL_MINUTES = int(os.environ.get('PASSWORD_RESET_TTL_MINUTES', 30))
+PASSWORD_RESET_PURGE_MINUTES = int(os.environ.get('PASSWORD_RESET_PURGE_MINUTES', 60))
+APP_BASE_URL = os.environ.get('APP_BASE_URL', '').rstrip('/')
+
+# Opt-in: /create-invoice renders the new invoice's PDF in the background, so the
+# download that usually follows finds it finished and needs no render
+SPECULATIVE_INVOICES = os.environ.get('SPECULATIVE_INVOICES', '0') == '1'
+SPECULATIVE_TTL_SECONDS = int(os.environ.get('SPECULATIVE_TTL_SECONDS', 300))
+SPECULATIVE_MAX_ENTRIES = int(os.environ.get('SPECULATIVE_MAX_ENTRIES', 64))
+SPECULATIVE_MAX_MB = float(os.environ.get('SPECULATIVE_MAX_MB', 32))
+
+# Rendered template fragments: report sections, the dashboard's records table and the result
+# summary. 'memory' keeps an LRU per worker; 'sqlite' shares one bounded cache file between workers.
+FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND', 'memory').lower()
+FRAGMENT_CACHE_DATABASE = os.environ.get('FRAGMENT_CACHE_DATABASE') or os.path.join(basedir, 'fragments.db')
+FRAGMENT_CACHE_SHARED_SIZE = int(os.environ.get('FRAGMENT_CACHE_SHARED_SIZE', 5000))
+REPORT_FRAGMENT_CACHE_SIZE = int(os.environ.get('REPORT_FRAGMENT_CACHE_SIZE', 512))
+PATIENT_FRAGMENT_CACHE_SIZE = int(os.environ.get('PATIENT_FRAGMENT_CACHE_SIZE', 1024))
+
+HISTORY_CACHE_SIZE = int(os.environ.get('HISTORY_CACHE_SIZE', 256))
+HISTORY_MAX_POINTS = int(os.environ.get('HISTORY_MAX_POINTS', 2000))
+history_cache = history.SeriesCache(HISTORY_CACHE_SIZE)
+
+invoice_speculator = speculation.SpeculativeRenderer(
+    'invoice', ttl_seconds=SPECULATIVE_TTL_SECONDS, max_entries=SPECULATIVE_MAX_ENTRIES,
+    max_bytes=int(SPECULATIVE_MAX_MB * 1024 * 1024)
+)
+
+shared_fragment_store = None
+if FRAGMENT_CACHE_BACKEND == 'sqlite':
+    shared_fragment_store = fragments.SQLiteFragmentStore(FRAGMENT_CACHE_DATABASE, FRAGMENT_CACHE_SHARED_SIZE)
+report_fragments = fragments.FragmentCache('report', REPORT_FRAGMENT_CACHE_SIZE, shared_fragment_store)
+patient_fragments = fragments.FragmentCache('patient', PATIENT_FRAGMENT_CACHE_SIZE, shared_fragment_store)
+metrics.register_collector(report_fragments.collect_metrics)
+metrics.register_collector(patient_fragments.collect_metrics)
+
+if RATE_LIMIT_BACKEND == 'off':
+    rate_limiter = ratelimit.RateLimiter(None, {name: {} for name in RATE_LIMITS})
+elif RATE_LIMIT_BACKEND == 'sqlite':
+    rate_limiter = ratelimit.RateLimiter(ratelimit.SQLiteBucketStore(RATE_LIMIT_DATABASE), RATE_LIMITS)
+else:
+    rate_limiter = ratelimit.RateLimiter(ratelimit.MemoryBucketStore(), RATE_LIMITS)
+
 def get_ist_now():
     return datetime.now(IST)
 
-def format_date_display(date_str):
+def to_epoch_ms(dt):
+    return int(dt.timestamp() * 1000)
+
+def now_ms():
+    return to_epoch_ms(datetime.now(timezone.utc))
+
+def months_ago_ms(months):
+    # Same calendar arithmetic as SQLite's date('now', '-N months'), at midnight UTC
+    today = datetime.now(timezone.utc).date()
+    year, month = divmod(today.year * 12 + today.month - 1 - months, 12)
+    day = min(today.day, calendar.monthrange(year, month + 1)[1])
+    return to_epoch_ms(datetime(year, month + 1, day, tzinfo=timezone.utc))
+
+# Not cached: every row has its own millisecond, so a cache would never hit, and one
+# fromtimestamp + strftime is already cheap. init_shard_db fills date_ms for legacy rows.
+def format_ist(epoch_ms, fmt='%d-%m-%Y %H:%M:%S'):
+    if epoch_ms is None:
+        return ''
+    return datetime.fromtimestamp(epoch_ms / 1000, IST).strftime(fmt)
+
+def parse_db_timestamp(value, tz=timezone.utc):
+    # SQLite CURRENT_TIMESTAMP values are UTC, invoice dates are written in IST
+    if not value:
+        return None
     try:
-        if isinstance(date_str, str):
-            dt = datetime.fromisoformat(date_str.replace('Z', '+00:00')) if 'T' in date_str else datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=timezone.utc)
-            dt_ist = dt.astimezone(IST)
-        else:
-            dt_ist = date_str.astimezone(IST) if date_str.tzinfo else date_str.replace(tzinfo=timezone.utc).astimezone(IST)
-        return dt_ist.strftime('%d-%m-%Y %H:%M:%S')
-    except Exception as e:
-        print(f"DEBUG: Date format error: {e}")
-        return str(date_str)[:19]
+        dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=tz)
+    return dt
+
+def parse_db_timestamp_ms(value, utc_offset_minutes=0):
+    dt = parse_db_timestamp(value, tz=timezone(timedelta(minutes=utc_offset_minutes)))
+    return to_epoch_ms(dt) if dt else None
 
-def get_db():
-    db = sqlite3.connect(DATABASE)
+def connect_db(path):
+    db = sqlite3.connect(path)
     db.row_factory = sqlite3.Row
     return db
 
-def init_db():
-    db = get_db()
-    cursor = db.cursor()
+def shard_for(patient_id):
+    return shards.shard_index(patient_id, DB_SHARDS)
+
+def shard_database(index):
+    return shards.shard_path(DATABASE, index)
+
+def all_shard_databases():
+    return shards.shard_paths(DATABASE, DB_SHARDS)
+
+def all_archive_databases():
+    # (index, path) of every archive shard written so far
+    return shards.existing_shard_paths(ARCHIVE_DATABASE)
+
+def get_db(patient_id=None):
+    # Users and password reset tokens live on the primary; readings and invoices live on the patient's shard
+    if patient_id is None:
+        return connect_db(DATABASE)
+    return connect_db(shard_database(shard_for(patient_id)))
+
+RECORD_QUERY = 'SELECT * FROM {0}.bmi_records WHERE id = ? AND patient_id = ?'
+INVOICE_QUERY = ('SELECT i.*, b.age, b.gender, b.height, b.weight, b.bmi, b.category FROM {0}.invoices i '
+                 'JOIN {1}.bmi_records b ON i.record_id = b.id '
+                 'WHERE i.id = ? AND i.patient_id = ?')
+
+def archive_database_for(patient_id):
+    return shards.shard_path(ARCHIVE_DATABASE, shard_for(patient_id))
+
+def fetch_record(db, record_id, patient_id):
+    record = db.execute(RECORD_QUERY.format('main'), (record_id, patient_id)).fetchone()
+    if record is None and archive.attach_archive(db, archive_database_for(patient_id)):
+        record = db.execute(RECORD_QUERY.format('archive'), (record_id, patient_id)).fetchone()
+    return record
+
+RECORD_INVOICE_QUERY = ('SELECT id, invoice_number, invoice_date, total_amount FROM {0}.invoices '
+                        'WHERE record_id = ? AND patient_id = ? ORDER BY id LIMIT 1')
+
+def fetch_record_invoice(db, record_id, patient_id):
+    # The invoice already issued for a reading (the oldest, for readings billed more than once before)
+    invoice = db.execute(RECORD_INVOICE_QUERY.format('main'), (record_id, patient_id)).fetchone()
+    if invoice is None and archive.attach_archive(db, archive_database_for(patient_id)):
+        invoice = db.execute(RECORD_INVOICE_QUERY.format('archive'), (record_id, patient_id)).fetchone()
+    return invoice
+
+def patient_version(db, patient_id):
+    row = db.execute('SELECT version FROM patient_versions WHERE patient_id = ?', (patient_id,)).fetchone()
+    return row[0] if row else 0
+
+def fetch_invoice(db, invoice_id, patient_id):
+    invoice = db.execute(INVOICE_QUERY.format('main', 'main'), (invoice_id, patient_id)).fetchone()
+    if invoice is None and archive.attach_archive(db, archive_database_for(patient_id)):
+        # An invoice created after its reading was archived stays hot while the reading is cold
+        for schemas in (('archive', 'archive'), ('main', 'archive'), ('archive', 'main')):
+            invoice = db.execute(INVOICE_QUERY.format(*schemas), (invoice_id, patient_id)).fetchone()
+            if invoice is not None:
+                break
+    return invoice
+
+# One group-commit writer per shard file
+_bmi_writers = {}
+
+def get_bmi_writer(patient_id=None):
+    database = shard_database(shard_for(patient_id))
+    if database not in _bmi_writers:
+        _bmi_writers[database] = GroupCommitWriter(database, max_batch=BMI_GROUP_COMMIT_ROWS,
+                                                   max_delay_ms=BMI_GROUP_COMMIT_MS, synchronous=BMI_GROUP_COMMIT_SYNC)
+    return _bmi_writers[database]
+
+def insert_bmi_record(db, values):
+    cursor = db.execute(
+        'INSERT INTO bmi_records (patient_id, age, gender, height, weight, bmi, category, date_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        values
+    )
+    analytics.record_bmi(db, values[6], values[7])
+    return cursor.lastrowid
+
+def save_bmi_record(values):
+    if BMI_GROUP_COMMIT:
+        record_id = get_bmi_writer(values[0]).run(lambda db: insert_bmi_record(db, values))
+    else:
+        db = get_db(values[0])
+        try:
+            record_id = insert_bmi_record(db, values)
+            db.commit()
+        finally:
+            db.close()
     
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    history_cache.invalidate_patient(values[0])
+    return record_id
+
+def get_reporting_db(index=0):
+    # Reporting reads go to the latest snapshot when enabled, so they never contend with writers
+    if ANALYTICS_USE_SNAPSHOT:
+        snapshot = backup.open_snapshot(shards.shard_path(SNAPSHOT_DATABASE, index))
+        if snapshot is not None:
+            # The archive copied with the snapshot matches it; snapshots older than the archive fall back to the live one
+            if not archive.attach_archive(snapshot, shards.shard_path(backup.archive_path(SNAPSHOT_DATABASE), index)):
+                archive.attach_archive(snapshot, shards.shard_path(ARCHIVE_DATABASE, index))
+            return snapshot
+    db = connect_db(shard_database(index))
+    archive.attach_archive(db, shards.shard_path(ARCHIVE_DATABASE, index))
+    return db
+
+def fan_out_shards(fn, connect=None):
+    # Cross-shard reporting: runs fn(db) on every shard in parallel, results in shard order
+    return shards.fan_out(range(DB_SHARDS), fn, connect or (lambda index: connect_db(shard_database(index))))
+
+def init_shard_db(db, index):
+    # Patient-owned tables, created on every shard (shard 0 is the primary database)
+    cursor = db.cursor()
     
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS bmi_records (
@@ -85,6 +385,7 @@ def init_db():
             bmi REAL NOT NULL,
             category TEXT NOT NULL,
             date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            date_ms INTEGER,
             FOREIGN KEY (patient_id) REFERENCES users(id)
         )
     ''')
@@ -102,6 +403,11 @@ def init_db():
             cursor.execute('ALTER TABLE bmi_records ADD COLUMN gender TEXT')
             db.commit()
             print("DEBUG: 'gender' column added successfully")
+        if 'date_ms' not in columns:
+            print("DEBUG: Adding 'date_ms' column to bmi_records table...")
+            cursor.execute('ALTER TABLE bmi_records ADD COLUMN date_ms INTEGER')
+            db.commit()
+            print("DEBUG: 'date_ms' column added successfully")
     except Exception as e:
         print(f"DEBUG: Error checking/adding columns: {e}")
     
@@ -118,12 +424,69 @@ def init_db():
             payment_status TEXT DEFAULT 'Pending',
             payment_terms TEXT DEFAULT 'Due within 30 days',
             invoice_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            invoice_date_ms INTEGER,
             due_date TIMESTAMP,
             FOREIGN KEY (patient_id) REFERENCES users(id),
             FOREIGN KEY (record_id) REFERENCES bmi_records(id)
         )
     ''')
     
+    try:
+        cursor.execute("PRAGMA table_info(invoices)")
+        columns = [column[1] for column in cursor.fetchall()]
+        if 'invoice_date_ms' not in columns:
+            print("DEBUG: Adding 'invoice_date_ms' column to invoices table...")
+            cursor.execute('ALTER TABLE invoices ADD COLUMN invoice_date_ms INTEGER')
+            db.commit()
+            print("DEBUG: 'invoice_date_ms' column added successfully")
+    except Exception as e:
+        print(f"DEBUG: Error checking/adding columns: {e}")
+    
+    # One-time normalisation of the legacy text timestamps: bmi_records.date is
+    # UTC (CURRENT_TIMESTAMP), invoices.invoice_date was written in IST
+    db.create_function('parse_db_timestamp_ms', 2, parse_db_timestamp_ms)
+    cursor.execute('UPDATE bmi_records SET date_ms = parse_db_timestamp_ms(date, 0) WHERE date_ms IS NULL')
+    cursor.execute('UPDATE invoices SET invoice_date_ms = parse_db_timestamp_ms(invoice_date, 330) WHERE invoice_date_ms IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bmi_records_patient_date ON bmi_records (patient_id, date_ms)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_invoices_patient_date ON invoices (patient_id, invoice_date_ms)')
+    
+    # Per-patient change counter for the fragment caches. Triggers bump it in the same transaction
+    # as every insert or delete, whether it comes from a route, the group-commit writer, archiving
+    # or split-shards, so cached fragments are invalidated exactly and on every worker.
+    cursor.execute('CREATE TABLE IF NOT EXISTS patient_versions (patient_id INTEGER PRIMARY KEY, version INTEGER NOT NULL)')
+    for table in shards.SHARDED_TABLES:
+        for event, row in (('INSERT', 'NEW'), ('DELETE', 'OLD')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS bump_patient_version_{table}_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO patient_versions (patient_id, version) VALUES ({row}.patient_id, 1)
+                    ON CONFLICT (patient_id) DO UPDATE SET version = version + 1;
+                END
+            ''')
+    
+    # A fresh rollup table is filled from archived history too
+    db.commit()
+    archive.attach_archive(db, shards.shard_path(ARCHIVE_DATABASE, index))
+    analytics.init_analytics_tables(cursor)
+    shards.seed_id_sequences(db, index)
+    db.commit()
+
+def init_db():
+    db = get_db()
+    cursor = db.cursor()
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    init_shard_db(db, 0)
+    
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS password_reset_tokens (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -135,9 +498,216 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES users(id)
         )
     ''')
+    reset_tokens.ensure_indexes(db)
+    
+    campaign.init_campaign_tables(db)
     
     db.commit()
     db.close()
+    
+    for index in range(1, DB_SHARDS):
+        shard_db = connect_db(shard_database(index))
+        init_shard_db(shard_db, index)
+        shard_db.close()
+
+_schema_ready = False
+backup_scheduler = backup.BackupScheduler(all_shard_databases, BACKUP_DIR, SNAPSHOT_DATABASE, BACKUP_INTERVAL_MINUTES,
+                                          keep=BACKUP_KEEP, pages=BACKUP_PAGES_PER_STEP,
+                                          archive_paths=all_archive_databases)
+reset_token_purger = reset_tokens.PurgeScheduler(get_db, lambda: now_ms(), PASSWORD_RESET_PURGE_MINUTES)
+
+@app.before_request
+def ensure_schema():
+    # gunicorn never runs the __main__ block, so apply migrations once per worker
+    global _schema_ready
+    if not _schema_ready:
+        init_db()
+        backup_scheduler.start()
+        reset_token_purger.start()
+        # Again after a fork (gunicorn --preload resets worker signal handlers); a no-op otherwise
+        memory_profiler.install_signal_handler(MEMORY_PROFILE_SIGNAL)
+        _schema_ready = True
+
+@app.cli.command('init-db')
+def init_db_command():
+    init_db()
+    print("Database initialised")
+
+@app.cli.command('archive-old-records')
+@click.option('--days', default=ARCHIVE_RETENTION_DAYS, show_default=True, help='Keep readings newer than this many days hot')
+@click.option('--batch-size', default=1000, show_default=True, help='Readings moved per transaction')
+@click.option('--vacuum', is_flag=True, help='VACUUM the hot database afterwards to return freed pages to the OS')
+def archive_old_records_command(days, batch_size, vacuum):
+    cutoff_ms = now_ms() - days * 24 * 3600 * 1000
+    for index, database in enumerate(all_shard_databases()):
+        archive_database = shards.shard_path(ARCHIVE_DATABASE, index)
+        db = connect_db(database)
+        before = archive.size_report(db)
+        moved_records, moved_invoices = archive.archive_old_records(db, archive_database, cutoff_ms, batch_size)
+        db.execute('DETACH DATABASE archive')
+        if vacuum:
+            db.execute('VACUUM')
+        after = archive.size_report(db)
+        db.close()
+        
+        print(f"Archived {moved_records} readings and {moved_invoices} invoices older than {days} days to {archive_database}")
+        print(f"{'':<22}{'before':>16}{'after':>16}")
+        print(f"{'file bytes':<22}{before['main_file_bytes']:>16}{after['main_file_bytes']:>16}")
+        print(f"{'free bytes':<22}{before['main_free_bytes']:>16}{after['main_free_bytes']:>16}")
+        for table in archive.ARCHIVED_TABLES:
+            for key in ('rows', 'bytes'):
+                if key in before[table]:
+                    print(f"{table + ' ' + key:<22}{before[table][key]:>16}{after[table][key]:>16}")
+    
+    removed, freed = prune_invoice_pdfs()
+    print(f"Removed {removed} cached invoice PDFs ({freed} bytes) unused for {INVOICE_PDF_CACHE_DAYS:g} days or over {INVOICE_PDF_CACHE_MB:g} MB")
+
+@app.cli.command('backup-db')
+@click.argument('destination', required=False)
+@click.option('--pages', default=BACKUP_PAGES_PER_STEP, show_default=True, help='Pages copied per step')
+@click.option('--sleep', default=0.005, show_default=True, help='Seconds writers get between steps')
+@click.option('--snapshot', is_flag=True, help='Refresh the read-only reporting snapshot instead')
+def backup_db_command(destination, pages, sleep, snapshot):
+    if snapshot:
+        destination = SNAPSHOT_DATABASE
+    elif not destination:
+        destination = os.path.join(BACKUP_DIR, f"database-{datetime.now().strftime('%Y%m%d_%H%M%S')}.db")
+    start = time.perf_counter()
+    archive_paths = all_archive_databases()
+    try:
+        steps = backup.backup_shards(all_shard_databases(), destination, archive_paths, pages=pages, sleep=sleep)
+    except backup.BackupTimeout as e:
+        raise click.ClickException(f"Backup abandoned, the database never went quiet: {e}")
+    print(f"Backed up {DB_SHARDS} shard(s) of {DATABASE} and {len(archive_paths)} archive shard(s) to {destination} "
+          f"in {steps} steps ({time.perf_counter() - start:.2f}s)")
+
+@app.cli.command('send-campaign')
+@click.argument('name')
+@click.option('--kind', type=click.Choice(['reminder', 'report']), default='reminder', show_default=True,
+              help='reminder: plain-text nudge; report: attaches a PDF of the latest reading')
+@click.option('--due-days', default=30, show_default=True, help='Mail patients whose latest reading is older than this')
+@click.option('--chunk-size', default=200, show_default=True, help='Recipients read from the database at a time')
+@click.option('--render-workers', default=4, show_default=True, help='Threads building messages and PDF attachments')
+@click.option('--connections', default=2, show_default=True, help='SMTP sessions kept open')
+@click.option('--max-per-connection', default=100, show_default=True, help='Messages per session before it is reopened')
+@click.option('--rate', default='5/1', show_default=True, help='Send rate as burst/seconds; 0 for no limit')
+@click.option('--dry-run', is_flag=True, help='Select and render everything, but send nothing and record no progress')
+@click.option('--smtp-host', default=SMTP_HOST, show_default=True)
+@click.option('--smtp-port', default=SMTP_PORT, show_default=True)
+@click.option('--ssl/--no-ssl', 'use_ssl', default=SMTP_SSL, show_default=True)
+def send_campaign_command(name, kind, due_days, chunk_size, render_workers, connections, max_per_connection,
+                          rate, dry_run, smtp_host, smtp_port, use_ssl):
+    # Re-running the same NAME retries earlier failures, then resumes after the last finished chunk;
+    # anyone already mailed is skipped
+    sender_email = os.getenv('GMAIL_EMAIL', 'noreply@localhost')
+    sender_password = os.getenv('GMAIL_PASSWORD', '')
+    pool = None
+    if not dry_run:
+        def connect():
+            server = smtp_connect(smtp_host, smtp_port, use_ssl)
+            server.ehlo_or_helo_if_needed()
+            if sender_password and server.has_extn('auth'):  # local stand-ins take mail without a login
+                server.login(sender_email, sender_password)
+            return server
+        pool = campaign.SMTPPool(connect, size=connections, max_messages=max_per_connection)
+        try:
+            pool.warm()
+        except Exception as e:
+            raise click.ClickException(f"Cannot connect to {smtp_host}:{smtp_port}: {e}")
+    
+    init_db()
+    db = get_db()
+    try:
+        checkpoint = campaign.Checkpoint(db, name, kind, now_ms() - due_days * 86400000, now_ms, dry_run=dry_run)
+    except ValueError as e:
+        db.close()
+        if pool is not None:
+            pool.close()
+        raise click.ClickException(str(e))
+    retry_ids = checkpoint.failed()
+    if checkpoint.resumed:
+        print(f"Resuming {name} after user {checkpoint.last_user_id}"
+              f"{f', retrying {len(retry_ids)} failed recipient(s) first' if retry_ids else ''}")
+    
+    start = time.perf_counter()
+    try:
+        totals = campaign.run_campaign(
+            checkpoint,
+            itertools.chain(campaign.iter_users_by_id(db, retry_ids, chunk_size),
+                            campaign.iter_user_chunks(db, checkpoint.last_user_id, chunk_size)),
+            lambda users: due_campaign_recipients(users, checkpoint.due_before_ms),
+            lambda user, reading: render_campaign_email(kind, sender_email, user, reading),
+            pool,
+            campaign.Throttle(ratelimit.parse_rate(rate)),
+            render_workers=render_workers
+        )
+    finally:
+        db.close()
+    print(f"{name}: {'would send' if dry_run else 'sent'} {totals['sent']}, failed {totals['failed']}, "
+          f"skipped {totals['skipped']} in {time.perf_counter() - start:.1f}s"
+          f"{'' if dry_run else f' over {pool.opened} SMTP session(s)'}")
+
+@app.cli.command('build-assets')
+@click.option('--clean', is_flag=True, help='Remove fingerprinted files no longer in the manifest')
+def build_assets_command(clean):
+    manifest = assets.build_assets(app.static_folder, ASSET_DIST_DIR)
+    for logical, hashed in sorted(manifest.items()):
+        print(f"{logical} -> dist/{hashed}")
+    if clean:
+        print(f"Removed {assets.clean_dist(ASSET_DIST_DIR, manifest)} stale files")
+
+@app.cli.command('purge-reset-tokens')
+@click.option('--batch-size', default=500, show_default=True, help='Tokens deleted per transaction')
+def purge_reset_tokens_command(batch_size):
+    db = get_db()
+    removed = reset_tokens.purge_expired(db, now_ms(), batch_size)
+    db.close()
+    print(f"Removed {removed} expired or used password reset tokens")
+
+@app.cli.command('rebuild-analytics')
+def rebuild_analytics_command():
+    # Archived readings and invoices are included, so archiving never shrinks the rollups
+    for index, database in enumerate(all_shard_databases()):
+        db = connect_db(database)
+        archive.attach_archive(db, shards.shard_path(ARCHIVE_DATABASE, index))
+        analytics.rebuild_rollups(db)
+        db.commit()
+        db.close()
+    print("Analytics rollups rebuilt")
+
+@app.cli.command('split-shards')
+@click.option('--shards', 'count', default=DB_SHARDS, show_default=True, help='Target number of shard files')
+@click.option('--batch-size', default=500, show_default=True, help='Patients moved per transaction')
+def split_shards_command(count, batch_size):
+    # Stop the app first, then restart it with DB_SHARDS=<count>
+    def prepare_shard(path, index):
+        db = connect_db(path)
+        init_shard_db(db, index)
+        db.close()
+    
+    def prepare_archive(path, index):
+        db = connect_db(shards.shard_path(DATABASE, index))
+        archive.attach_archive(db, path, create=True)
+        db.close()
+    
+    moved = shards.rebalance(DATABASE, count, batch_size, prepare=prepare_shard)
+    print(f"Moved {moved['bmi_records']} readings and {moved['invoices']} invoices "
+          f"({moved['renumbered']} renumbered) across {count} shard(s)")
+    if shards.existing_shard_paths(ARCHIVE_DATABASE):
+        moved = shards.rebalance(ARCHIVE_DATABASE, count, batch_size, prepare=prepare_archive, renumber=False)
+        print(f"Moved {moved['bmi_records']} archived readings and {moved['invoices']} archived invoices")
+    
+    for index, path in shards.existing_shard_paths(DATABASE):
+        db = connect_db(path)
+        archive.attach_archive(db, shards.shard_path(ARCHIVE_DATABASE, index))
+        analytics.rebuild_rollups(db)
+        db.commit()
+        db.close()
+        if index >= count:
+            print(f"{path} is now empty and can be removed")
+    print(f"Restart the app with DB_SHARDS={count}")
+
+app.add_template_filter(format_ist, 'ist')
 
 def login_required(f):
     @wraps(f)
@@ -147,25 +717,64 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def get_bmi_category(bmi):
-    if bmi < 18.5:
-        return 'Underweight'
-    elif bmi < 25:
-        return 'Normal'
-    elif bmi < 30:
-        return 'Overweight'
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return redirect(url_for('login'))
+        if str(session.get('user_email', '')).lower() not in ADMIN_EMAILS:
+            return jsonify({'success': False, 'error': 'Admin access required'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+def rate_limited(endpoint_class):
+    # Goes below login_required so anonymous requests are redirected without spending tokens
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with rate_limiter.admit(endpoint_class, session.get('user_id')):
+                return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+# Bump ETAG_VERSION when a template or PDF layout changes so cached copies are refetched
+ETAG_VERSION = os.environ.get('ETAG_VERSION', '1')
+
+def make_etag(*parts):
+    payload = '\x1f'.join(str(part) for part in (ETAG_VERSION,) + parts)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+def set_cache_headers(response, etag, last_modified=None):
+    # Authenticated content: browsers may keep a private copy but must revalidate it
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.cache_control.public = False
+    response.vary.add('Cookie')
+    return response
+
+def not_modified(etag, last_modified=None):
+    if request.if_none_match:
+        # Weak comparison: compressed responses carry W/"..." for the same representation
+        matched = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since is not None:
+        matched = request.if_modified_since >= last_modified.replace(microsecond=0)
     else:
-        return 'Obese'
+        matched = False
+    
+    if not matched:
+        return None
+    return set_cache_headers(app.response_class(status=304), etag, last_modified)
+
+def get_bmi_category(bmi, age=None, gender=None):
+    return classify(bmi, age, gender)
 
 def get_health_advice(category):
-    advice = {
-        'Underweight': 'Consider consulting a healthcare professional. A balanced diet with adequate calories and nutrients is important.',
-        'Normal': 'Great! Maintain your healthy weight with regular exercise and a balanced diet.',
-        'Overweight': 'Consider a healthier lifestyle with regular physical activity and a balanced diet. Consult a healthcare provider if needed.',
-        'Obese': 'It is highly recommended to consult a healthcare professional for personalized advice on weight management.'
-    }
-    return advice.get(category, '')
+    return HEALTH_ADVICE.get(category, '')
 
+@memory_profiler.profiled('bmi_pdf')
 def generate_pdf(patient_name, patient_id, height, weight, bmi, category, date_str, gender=None, age=None):
     pdf_filename = f"BMI_Report_{patient_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
     pdf_path = os.path.join(TEMP_PDF_DIR, pdf_filename)
@@ -303,12 +912,18 @@ def generate_pdf(patient_name, patient_id, height, weight, bmi, category, date_s
     doc.build(story)
     return pdf_path
 
+@memory_profiler.profiled('invoice_pdf')
 def generate_invoice_pdf(patient_name, patient_id, invoice_number, height, weight, bmi, category, 
                          consultation_fee, bmi_assessment_fee, health_report_fee, 
                          total_amount, payment_terms, invoice_date_str, age=None, gender=None):
     pdf_filename = f"BMI_Report_{invoice_number}_{patient_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
     pdf_path = os.path.join(TEMP_PDF_DIR, pdf_filename)
     
+    # Content comes from invoice_report, shared with the /report/<id> HTML view
+    sections = {section['key']: section for section in invoice_report.build_sections(
+        patient_name, invoice_number, invoice_date_str, height, weight, bmi, category, age=age, gender=gender
+    )}
+    
     # Use A4 as requested
     doc = SimpleDocTemplate(pdf_path, pagesize=A4, topMargin=0.4*inch, bottomMargin=0.4*inch, leftMargin=0.5*inch, rightMargin=0.5*inch)
     story = []
@@ -321,23 +936,8 @@ def generate_invoice_pdf(patient_name, patient_id, invoice_number, height, weigh
     border_gray = colors.HexColor('#E5E7EB')
     light_blue = colors.HexColor('#F0F7FF')
     
-    # Category Colors (Professional Hospital Standards)
-    bmi_colors = {
-        'Underweight': colors.HexColor('#2563EB'), # Blue
-        'Normal': colors.HexColor('#059669'),      # Green
-        'Overweight': colors.HexColor('#D97706'),  # Amber
-        'Obese': colors.HexColor('#DC2626')        # Red
-    }
-    status_color = bmi_colors.get(category, hospital_blue)
-
-    # Risk Level & Classification
-    risk_data = {
-        'Underweight': ('High Risk', 'Nutritional Deficit'),
-        'Normal': ('Low Risk', 'Optimal Health Range'),
-        'Overweight': ('Moderate Risk', 'Increased Health Risk'),
-        'Obese': ('High Risk', 'Significant Health Risk')
-    }
-    risk_level, classification = risk_data.get(category, ('N/A', 'N/A'))
+    # Category colour (single source in bmi_classifier)
+    status_color = colors.HexColor(sections['result']['color']) if sections['result']['color'] else hospital_blue
 
     # Styles
     header_style = ParagraphStyle('Header', fontSize=22, fontName='Helvetica-Bold', textColor=hospital_blue, leading=26)
@@ -353,15 +953,17 @@ def generate_invoice_pdf(patient_name, patient_id, invoice_number, height, weigh
     interpretation_style = ParagraphStyle('Interp', fontSize=10, fontName='Helvetica', textColor=text_dark, leading=14)
     guidance_style = ParagraphStyle('Guidance', fontSize=9.5, fontName='Helvetica', textColor=text_dark, leading=14, leftIndent=0)
     
-    footer_text_style = ParagraphStyle('FooterText', fontSize=8, fontName='Helvetica', textColor=text_muted)
-    disclaimer_style = ParagraphStyle('Disclaimer', fontSize=7.5, fontName='Helvetica', textColor=text_muted, alignment=TA_CENTER, leading=10)
+    def section_title(text):
+        return Table([[Paragraph(text, section_title_style)]], 
+                     colWidths=[7.2*inch], style=[('BACKGROUND', (0,0), (-1,-1), hospital_blue), ('TOPPADDING', (0,0), (-1,-1), 5), ('BOTTOMPADDING', (0,0), (-1,-1), 5)])
 
     # 1. Header & Branding
+    clinic = sections['header']['clinic']
     brand_content = [
         [
-            [Paragraph("LifeTrack Health Hub", header_style), 
-             Paragraph("MEDICAL & WELLNESS REPORT", sub_header_style)],
-            Paragraph("support@lifetrack.com<br/>+91 98765 43210<br/>www.lifetrack.com", contact_style)
+            [Paragraph(clinic['name'], header_style), 
+             Paragraph(clinic['subtitle'], sub_header_style)],
+            Paragraph("<br/>".join(clinic['contact']), contact_style)
         ]
     ]
     brand_table = Table(brand_content, colWidths=[4.2*inch, 3.0*inch])
@@ -374,8 +976,9 @@ def generate_invoice_pdf(patient_name, patient_id, invoice_number, height, weigh
     story.append(Spacer(1, 0.1*inch))
 
     # Report Metadata
+    meta = sections['meta']
     meta_data = [
-        [Paragraph(f"<b>Report ID:</b> {invoice_number} | <b>Date:</b> {invoice_date_str}", meta_style)]
+        [Paragraph(f"<b>Report ID:</b> {xml_escape(meta['report_id'])} | <b>Date:</b> {xml_escape(meta['date'])}", meta_style)]
     ]
     meta_table = Table(meta_data, colWidths=[7.2*inch])
     meta_table.setStyle(TableStyle([
@@ -385,14 +988,10 @@ def generate_invoice_pdf(patient_name, patient_id, invoice_number, height, weigh
     story.append(meta_table)
 
     # 2. Patient Information Section
-    story.append(Table([[Paragraph("PATIENT INFORMATION", section_title_style)]], 
-                       colWidths=[7.2*inch], style=[('BACKGROUND', (0,0), (-1,-1), hospital_blue), ('TOPPADDING', (0,0), (-1,-1), 5), ('BOTTOMPADDING', (0,0), (-1,-1), 5)]))
-    
+    story.append(section_title(sections['patient']['title']))
     patient_data = [
-        [Paragraph("Patient Name", label_style), Paragraph(f": {patient_name}", value_style), 
-         Paragraph("Age", label_style), Paragraph(f": {age} yrs" if age else ": N/A", value_style)],
-        [Paragraph("Gender", label_style), Paragraph(f": {gender}" if gender and str(gender).strip() else ": Not Specified", value_style), 
-         Paragraph("Visit Type", label_style), Paragraph(": Wellness Assessment", value_style)]
+        [cell for label, value in row for cell in (Paragraph(label, label_style), Paragraph(f": {xml_escape(value)}", value_style))]
+        for row in sections['patient']['rows']
     ]
     patient_table = Table(patient_data, colWidths=[1.2*inch, 2.4*inch, 1.2*inch, 2.4*inch])
     patient_table.setStyle(TableStyle([
@@ -405,14 +1004,10 @@ def generate_invoice_pdf(patient_name, patient_id, invoice_number, height, weigh
     story.append(Spacer(1, 0.2*inch))
 
     # 3. Anthropometric Measurements
-    story.append(Table([[Paragraph("ANTHROPOMETRIC MEASUREMENTS", section_title_style)]], 
-                       colWidths=[7.2*inch], style=[('BACKGROUND', (0,0), (-1,-1), hospital_blue), ('TOPPADDING', (0,0), (-1,-1), 5), ('BOTTOMPADDING', (0,0), (-1,-1), 5)]))
-    
+    story.append(section_title(sections['measurements']['title']))
     meas_data = [
-        [Paragraph("Height (cm)", label_style), Paragraph(f"{height} cm", value_style), 
-         Paragraph("Weight (kg)", label_style), Paragraph(f"{weight} kg", value_style)],
-        [Paragraph("BMI Reference", label_style), Paragraph("WHO Standards", value_style),
-         Paragraph("WHO Category", label_style), Paragraph(classification, value_style)]
+        [cell for label, value in row for cell in (Paragraph(label, label_style), Paragraph(xml_escape(value), value_style))]
+        for row in sections['measurements']['rows']
     ]
     meas_table = Table(meas_data, colWidths=[1.2*inch, 2.4*inch, 1.2*inch, 2.4*inch])
     meas_table.setStyle(TableStyle([
@@ -429,8 +1024,8 @@ def generate_invoice_pdf(patient_name, patient_id, invoice_number, height, weigh
     bmi_cat_style = ParagraphStyle('BMICat', fontSize=14, fontName='Helvetica-Bold', alignment=TA_CENTER, textColor=status_color)
     
     bmi_card_content = [
-        [Paragraph(f"{bmi:.2f}", bmi_val_style)],
-        [Paragraph(category.upper(), bmi_cat_style)]
+        [Paragraph(sections['result']['bmi'], bmi_val_style)],
+        [Paragraph(xml_escape(sections['result']['category']), bmi_cat_style)]
     ]
     bmi_card = Table(bmi_card_content, colWidths=[2.5*inch])
     bmi_card.setStyle(TableStyle([
@@ -445,33 +1040,20 @@ def generate_invoice_pdf(patient_name, patient_id, invoice_number, height, weigh
     story.append(Spacer(1, 0.25*inch))
 
     # 5. Clinical Interpretation
-    story.append(Table([[Paragraph("CLINICAL INTERPRETATION", section_title_style)]], 
-                       colWidths=[7.2*inch], style=[('BACKGROUND', (0,0), (-1,-1), hospital_blue), ('TOPPADDING', (0,0), (-1,-1), 5), ('BOTTOMPADDING', (0,0), (-1,-1), 5)]))
-    
-    interp_text = f"""
-    Based on the recorded Body Mass Index (BMI) of <b>{bmi:.2f}</b>, the patient is clinically classified as <b>{category}</b>. 
-    This assessment indicates a <b>{risk_level}</b> risk level according to World Health Organization (WHO) protocols. 
-    BMI is a specialized screening tool used by healthcare professionals to evaluate body composition and related health risks.
-    """
+    story.append(section_title(sections['interpretation']['title']))
+    interp_text = ''.join(
+        f"<b>{xml_escape(text)}</b>" if bold else xml_escape(text)
+        for text, bold in sections['interpretation']['parts']
+    )
     story.append(Spacer(1, 0.1*inch))
     story.append(Paragraph(interp_text, interpretation_style))
     story.append(Spacer(1, 0.2*inch))
 
     # 6. Doctor's Wellness Prescription
-    story.append(Table([[Paragraph("<b style='font-size:12px;'>Rx</b> - DOCTOR'S WELLNESS PRESCRIPTION", section_title_style)]], 
-                       colWidths=[7.2*inch], style=[('BACKGROUND', (0,0), (-1,-1), hospital_blue), ('TOPPADDING', (0,0), (-1,-1), 5), ('BOTTOMPADDING', (0,0), (-1,-1), 5)]))
-    
-    prescription_items = [
-        "Maintain a balanced nutritional intake focusing on whole grains, lean proteins, and micronutrients.",
-        "Ensure consistent physical activity (minimum 150 minutes of moderate aerobic exercise weekly).",
-        "Monitor hydration levels (2.5 - 3.0 Liters daily) and maintain a consistent sleep-wake cycle.",
-        "Limit intake of processed carbohydrates, saturated fats, and high-sodium dietary items.",
-        "Schedule a follow-up consultation with a clinical specialist for personalized metabolic evaluation."
-    ]
-    
-    for item in prescription_items:
+    story.append(section_title(f"<b style='font-size:12px;'>Rx</b> - {xml_escape(sections['prescription']['title'])}"))
+    for item in sections['prescription']['items']:
         story.append(Spacer(1, 0.05*inch))
-        story.append(Paragraph(f"&bull; {item}", guidance_style))
+        story.append(Paragraph(f"&bull; {xml_escape(item)}", guidance_style))
     
     story.append(Spacer(1, 0.4*inch))
 
@@ -479,43 +1061,14 @@ def generate_invoice_pdf(patient_name, patient_id, invoice_number, height, weigh
     doc_label_style = ParagraphStyle('DocLabel', fontSize=9, fontName='Helvetica-Bold', textColor=text_dark)
     doc_sub_style = ParagraphStyle('DocSub', fontSize=8, fontName='Helvetica', textColor=text_muted)
     
-    doctors_data = [
-        [
-            [Paragraph("Dr. Sarah Thompson (MD)", doc_label_style),
-             Paragraph("Primary Consultant (Endocrinology)", doc_sub_style),
-             Paragraph("Reg No: LT-DR-001", doc_sub_style)],
-            [Paragraph("Dr. Rajesh Kumar (MS)", doc_label_style),
-             Paragraph("Clinical Nutritionist", doc_sub_style),
-             Paragraph("Reg No: LT-DR-002", doc_sub_style)],
-            [Paragraph("Dr. Anita Desai (MD)", doc_label_style),
-             Paragraph("General Medicine", doc_sub_style),
-             Paragraph("Reg No: LT-DR-003", doc_sub_style)]
-        ]
-    ]
-    
-    # Define alignments for each column
-    col_style1 = ParagraphStyle('Col1', parent=doc_label_style, alignment=TA_LEFT)
-    col_sub1 = ParagraphStyle('Sub1', parent=doc_sub_style, alignment=TA_LEFT)
-    
-    col_style2 = ParagraphStyle('Col2', parent=doc_label_style, alignment=TA_CENTER)
-    col_sub2 = ParagraphStyle('Sub2', parent=doc_sub_style, alignment=TA_CENTER)
-    
-    col_style3 = ParagraphStyle('Col3', parent=doc_label_style, alignment=TA_RIGHT)
-    col_sub3 = ParagraphStyle('Sub3', parent=doc_sub_style, alignment=TA_RIGHT)
-
-    doctors_content = [
-        [
-            [Paragraph("Dr. Sarah Thompson (MD)", col_style1),
-             Paragraph("Primary Consultant (Endocrinology)", col_sub1),
-             Paragraph("Reg No: LT-DR-001", col_sub1)],
-            [Paragraph("Dr. Rajesh Kumar (MS)", col_style2),
-             Paragraph("Clinical Nutritionist", col_sub2),
-             Paragraph("Reg No: LT-DR-002", col_sub2)],
-            [Paragraph("Dr. Anita Desai (MD)", col_style3),
-             Paragraph("General Medicine", col_sub3),
-             Paragraph("Reg No: LT-DR-003", col_sub3)]
-        ]
-    ]
+    # Left, centre and right aligned columns
+    alignments = (TA_LEFT, TA_CENTER, TA_RIGHT)
+    doctors_content = [[
+        [Paragraph(name, ParagraphStyle(f'Col{i + 1}', parent=doc_label_style, alignment=alignment)),
+         Paragraph(role, ParagraphStyle(f'Sub{i + 1}', parent=doc_sub_style, alignment=alignment)),
+         Paragraph(registration, ParagraphStyle(f'Sub{i + 1}', parent=doc_sub_style, alignment=alignment))]
+        for i, ((name, role, registration), alignment) in enumerate(zip(sections['doctors']['doctors'], alignments))
+    ]]
     
     doctors_table = Table(doctors_content, colWidths=[2.3*inch, 2.6*inch, 2.3*inch])
     doctors_table.setStyle(TableStyle([
@@ -531,12 +1084,8 @@ def generate_invoice_pdf(patient_name, patient_id, invoice_number, height, weigh
     sig_sub_style = ParagraphStyle('SigSub', fontSize=9, fontName='Helvetica-Bold', alignment=TA_CENTER, textColor=text_dark)
     sig_verify_style = ParagraphStyle('SigVerify', fontSize=8, fontName='Helvetica', alignment=TA_CENTER, textColor=text_muted)
     
-    sig_content = [
-        [Paragraph("Authorized Signature", sig_text_style)],
-        [Paragraph("LifeTrack Health Hub", sig_sub_style)],
-        [Paragraph("Medical & Wellness Report", sig_verify_style)],
-        [Paragraph("Digitally Verified Document", sig_verify_style)]
-    ]
+    sig_styles = [sig_text_style, sig_sub_style, sig_verify_style, sig_verify_style]
+    sig_content = [[Paragraph(line, style)] for line, style in zip(sections['signature']['lines'], sig_styles)]
     
     # Create a narrower table for the signature and align it to the right
     sig_table = Table(sig_content, colWidths=[2.5*inch])
@@ -557,6 +1106,130 @@ def generate_invoice_pdf(patient_name, patient_id, invoice_number, height, weigh
     doc.build(story)
     return pdf_path
 
+CONSULTATION_FEE = 500.00
+BMI_ASSESSMENT_FEE = 300.00
+HEALTH_REPORT_FEE = 200.00
+PAYMENT_TERMS = "Due within 30 days"
+
+def invoice_identity(patient_id, record_id, invoice_ms):
+    # Invoice number and display date are both derived from the creation time
+    ist_time = datetime.fromtimestamp(invoice_ms / 1000, IST)
+    invoice_number = f"INV-{patient_id}-{record_id}-{ist_time.strftime('%Y%m%d%H%M%S')}"
+    return invoice_number, ist_time.strftime('%Y-%m-%d %H:%M:%S')
+
+def invoice_pdf_etag(invoice, patient_name):
+    return make_etag('invoice-pdf', patient_name, *tuple(invoice))
+
+def invoice_pdf_path(invoice_number, etag):
+    # Named after everything the ETag covers, so a renamed patient or a new ETAG_VERSION gets a new file
+    return os.path.join(TEMP_PDF_DIR, f"Invoice_{invoice_number}_{etag[:16]}.pdf")
+
+def prune_invoice_pdfs(max_age_days=None, max_mb=None, keep=None):
+    # Returns (files removed, bytes freed). mtime is refreshed on every reuse, so it orders by last use.
+    max_age_days = INVOICE_PDF_CACHE_DAYS if max_age_days is None else max_age_days
+    max_bytes = (INVOICE_PDF_CACHE_MB if max_mb is None else max_mb) * 1024 * 1024
+    cached = []
+    with os.scandir(TEMP_PDF_DIR) as entries:
+        for entry in entries:
+            if entry.name.startswith('Invoice_') and entry.name.endswith('.pdf') and entry.path != keep:
+                stat = entry.stat()
+                cached.append((stat.st_mtime, stat.st_size, entry.path))
+    cached.sort()
+    cutoff = time.time() - max_age_days * 86400
+    total = sum(size for _, size, _ in cached)
+    removed = freed = 0
+    for mtime, size, path in cached:
+        if mtime >= cutoff and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # another worker got there first
+        total -= size
+        removed += 1
+        freed += size
+    return removed, freed
+
+def render_invoice_pdf(invoice, patient_name, patient_id):
+    return generate_invoice_pdf(
+        patient_name,
+        patient_id,
+        invoice['invoice_number'],
+        invoice['height'],
+        invoice['weight'],
+        invoice['bmi'],
+        invoice['category'],
+        invoice['consultation_fee'],
+        invoice['bmi_assessment_fee'],
+        invoice['health_report_fee'],
+        invoice['total_amount'],
+        invoice['payment_terms'],
+        invoice['invoice_date'],
+        age=invoice['age'],
+        gender=invoice['gender']
+    )
+
+def ensure_invoice_pdf(invoice, patient_name, patient_id, etag):
+    # Invoices never change once written, so the rendered PDF is kept on disk and reused
+    pdf_path = invoice_pdf_path(invoice['invoice_number'], etag)
+    if os.path.exists(pdf_path):
+        os.utime(pdf_path)
+        return pdf_path
+    
+    claimed = None
+    if SPECULATIVE_INVOICES:
+        # create_invoice may already be rendering it; wait for that instead of starting over
+        claimed = invoice_speculator.claim(('invoice', invoice['id']), lambda meta: meta['etag'] == etag)
+    rendered_path = claimed[1] if claimed else render_invoice_pdf(invoice, patient_name, patient_id)
+    os.replace(rendered_path, pdf_path)
+    removed, freed = prune_invoice_pdfs(keep=pdf_path)
+    if removed:
+        print(f"DEBUG: Pruned {removed} cached invoice PDFs ({freed} bytes)")
+    return pdf_path
+
+def deliver_pdf(pdf_path, download_name, last_modified=None):
+    if PDF_DELIVERY == 'nginx':
+        response = app.response_class(mimetype='application/pdf')
+        response.headers['X-Accel-Redirect'] = NGINX_PDF_PREFIX + os.path.basename(pdf_path)
+        response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        return response
+    
+    # 'apache' is handled by send_file itself through USE_X_SENDFILE
+    return send_file(
+        pdf_path,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=download_name,
+        etag=False,
+        last_modified=last_modified
+    )
+
+def smtp_connect(host=None, port=None, use_ssl=None):
+    host, port = host or SMTP_HOST, port or SMTP_PORT
+    use_ssl = SMTP_SSL if use_ssl is None else use_ssl
+    if use_ssl:
+        return smtplib.SMTP_SSL(host, port, timeout=30)
+    return smtplib.SMTP(host, port, timeout=30)
+
+@memory_profiler.profiled('email_message')
+def build_email(sender_email, recipient_email, subject, body, pdf_path=None):
+    message = MIMEMultipart()
+    message['From'] = sender_email
+    message['To'] = recipient_email
+    message['Subject'] = subject
+    message.attach(MIMEText(body, 'plain'))
+    
+    if pdf_path:
+        with open(pdf_path, 'rb') as attachment:
+            part = MIMEBase('application', 'octet-stream')
+            part.set_payload(attachment.read())
+            encoders.encode_base64(part)
+            part.add_header('Content-Disposition', f'attachment; filename= {os.path.basename(pdf_path)}')
+            message.attach(part)
+    return message
+
 def send_email(recipient_email, patient_name, pdf_path):
     sender_email = os.getenv('GMAIL_EMAIL', "your_email@gmail.com")
     sender_password = os.getenv('GMAIL_PASSWORD', "your_app_password")
@@ -569,11 +1242,6 @@ def send_email(recipient_email, patient_name, pdf_path):
         return False
     
     try:
-        message = MIMEMultipart()
-        message['From'] = sender_email
-        message['To'] = recipient_email
-        message['Subject'] = "BMI Prescription Report - Your Assessment"
-        
         body = f"""
 Dear {patient_name},
 
@@ -592,16 +1260,9 @@ LifeTrack Health Hub
 BMI Health Tracker
         """
         
-        message.attach(MIMEText(body, 'plain'))
+        message = build_email(sender_email, recipient_email, "BMI Prescription Report - Your Assessment", body, pdf_path)
         
-        with open(pdf_path, 'rb') as attachment:
-            part = MIMEBase('application', 'octet-stream')
-            part.set_payload(attachment.read())
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', f'attachment; filename= {os.path.basename(pdf_path)}')
-            message.attach(part)
-        
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
+        with smtp_connect() as server:
             server.login(sender_email, sender_password)
             server.send_message(message)
         
@@ -610,6 +1271,200 @@ BMI Health Tracker
         print(f"Error sending email: {str(e)}")
         return False
 
+# The account lookup, token write and email all run off the request thread, so
+# /send-reset-email answers in the same time whether or not the address belongs to an account
+reset_mailer = ThreadPoolExecutor(max_workers=2, thread_name_prefix='reset-mail')
+
+def send_reset_link(recipient_email, patient_name, link):
+    sender_email = os.getenv('GMAIL_EMAIL', "your_email@gmail.com")
+    sender_password = os.getenv('GMAIL_PASSWORD', "your_app_password")
+    
+    if sender_email == "your_email@gmail.com" or sender_password == "your_app_password":
+        print("❌ Email credentials not configured; password reset link not sent.")
+        metrics.inc('password_reset_emails_total', outcome='failed')
+        return False
+    
+    body = f"""
+Dear {patient_name},
+
+We received a request to reset the password for your LifeTrack Health Hub account.
+Open the link below to choose a new password. It expires in {PASSWORD_RESET_TTL_MINUTES} minutes and can only be used once.
+
+{link}
+
+If you did not ask for this, you can ignore this email; your password has not been changed.
+
+Best regards,
+LifeTrack Health Hub
+BMI Health Tracker
+    """
+    try:
+        message = build_email(sender_email, recipient_email, "Reset your LifeTrack Health Hub password", body)
+        with smtp_connect() as server:
+            server.login(sender_email, sender_password)
+            server.send_message(message)
+        metrics.inc('password_reset_emails_total', outcome='sent')
+        return True
+    except Exception as e:
+        print(f"Error sending password reset email: {str(e)}")
+        metrics.inc('password_reset_emails_total', outcome='failed')
+        return False
+
+def issue_reset_link(email, link_base):
+    # Runs on reset_mailer; link_base is the /reset-password URL worked out in the request
+    try:
+        db = get_db()
+        try:
+            user = db.execute('SELECT id, name, email FROM users WHERE email = ?', (email,)).fetchone()
+            if user is None:
+                metrics.inc('password_reset_requests_total', outcome='unknown_account')
+                return False
+            token = reset_tokens.issue_token(db, user['id'], now_ms(), PASSWORD_RESET_TTL_MINUTES * 60000)
+        finally:
+            db.close()
+    except Exception as e:
+        print(f"Error issuing password reset token: {str(e)}")
+        metrics.inc('password_reset_requests_total', outcome='failed')
+        return False
+    metrics.inc('password_reset_requests_total', outcome='issued')
+    return send_reset_link(user['email'], user['name'], f'{link_base}?token={token}')
+
+CAMPAIGN_SUBJECTS = {
+    'reminder': "Time for your BMI check-in - LifeTrack Health Hub",
+    'report': "Your monthly BMI report - LifeTrack Health Hub",
+}
+
+def render_campaign_email(kind, sender_email, user, reading):
+    # Runs on the campaign's render threads; report PDFs are read into the message and deleted
+    subject = CAMPAIGN_SUBJECTS[kind]
+    last_check = format_ist(reading['date_ms'], '%d %b %Y')
+    if kind == 'reminder':
+        days = max((now_ms() - reading['date_ms']) // 86400000, 0)
+        body = f"""
+Dear {user['name']},
+
+It has been {days} days since your last BMI check-in on {last_check}, when your BMI was {reading['bmi']} ({reading['category']}).
+
+Regular measurements make changes easier to spot early. Log in to LifeTrack Health Hub to record a new reading.
+
+Best regards,
+LifeTrack Health Hub
+BMI Health Tracker
+        """
+        return build_email(sender_email, user['email'], subject, body)
+    
+    body = f"""
+Dear {user['name']},
+
+Please find attached your monthly BMI report, based on your latest check-in on {last_check}.
+
+We recommend reviewing it and consulting with a healthcare professional if you have any concerns.
+
+Best regards,
+LifeTrack Health Hub
+BMI Health Tracker
+        """
+    pdf_path = generate_pdf(user['name'], user['id'], reading['height'], reading['weight'], reading['bmi'],
+                            reading['category'], format_ist(reading['date_ms']), gender=reading['gender'])
+    try:
+        return build_email(sender_email, user['email'], subject, body, pdf_path)
+    finally:
+        os.remove(pdf_path)
+
+def due_campaign_recipients(users, due_before_ms):
+    # Pairs each user with their latest reading (read from their shard, or its archive when every
+    # reading has been archived) and keeps those not seen since due_before_ms; patients with no
+    # readings on record are left out
+    by_shard = {}
+    for user in users:
+        by_shard.setdefault(shard_for(user['id']), []).append(user)
+    due = []
+    for index, shard_users in by_shard.items():
+        db = connect_db(shard_database(index))
+        latest = campaign.latest_readings(db, [user['id'] for user in shard_users])
+        archived_only = [user['id'] for user in shard_users if user['id'] not in latest]
+        if archived_only and archive.attach_archive(db, shards.shard_path(ARCHIVE_DATABASE, index)):
+            latest.update(campaign.latest_readings(db, archived_only, 'archive'))
+        db.close()
+        due.extend((user, latest[user['id']]) for user in shard_users
+                   if user['id'] in latest and latest[user['id']]['date_ms'] < due_before_ms)
+    return sorted(due, key=lambda pair: pair[0]['id'])
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(e):
+    response = jsonify({'success': False, 'errors': ['Server is busy, please try again in a moment']})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@app.errorhandler(ratelimit.RateLimited)
+def rate_limit_exceeded(e):
+    response = jsonify({'success': False, 'error': f'Too many requests, please try again in {e.retry_after} seconds'})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+def collect_app_metrics():
+    yield 'history_cache_hits_total', {}, history_cache.hits
+    yield 'history_cache_misses_total', {}, history_cache.misses
+    for database, writer in list(_bmi_writers.items()):
+        labels = {'shard': os.path.basename(database)}
+        yield 'bmi_group_commit_batches_total', labels, writer.batches
+        yield 'bmi_group_commit_jobs_total', labels, writer.jobs
+
+metrics.register_collector(collect_app_metrics)
+metrics.register_collector(memory_profiler.collect_metrics)
+
+@app.before_request
+def sample_request_memory():
+    g.memory_snapshot = memory_profiler.begin_request()
+
+@app.after_request
+def check_request_memory(response):
+    snapshot = g.pop('memory_snapshot', None)
+    if snapshot is not None:
+        memory_profiler.end_request(request.endpoint or 'unknown', snapshot)
+    
+    rss = memory_profiler.over_ceiling()
+    if rss is not None:
+        metrics.inc('memory_ceiling_reached_total')
+        if request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+            # SIGTERM is gunicorn's graceful stop for a worker: it finishes this response,
+            # exits, and the arbiter starts a fresh one in its place
+            print(f"DEBUG: Worker {os.getpid()} at {rss / 1048576:.0f} MiB is over MEMORY_CEILING_MB; recycling")
+            response.call_on_close(lambda: os.kill(os.getpid(), signal.SIGTERM))
+        else:
+            print(f"DEBUG: Process at {rss / 1048576:.0f} MiB is over MEMORY_CEILING_MB; restart it to recycle")
+    return response
+
+@app.after_request
+def count_response(response):
+    metrics.inc('http_responses_total', endpoint=request.endpoint or 'unknown', status=response.status_code)
+    return response
+
+@app.after_request
+def compress_dynamic_response(response):
+    if not COMPRESSION:
+        return response
+    return compression.compress_response(response, request.accept_encodings, COMPRESSION_MIN_BYTES,
+                                         COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_LEVEL)
+
+@app.route('/static/dist/<path:filename>')
+def fingerprinted_static(filename):
+    # Hashed names never change content, so browsers may keep them for a year without revalidating
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[encoding] and os.path.exists(os.path.join(ASSET_DIST_DIR, filename + suffix)):
+            response = send_from_directory(ASSET_DIST_DIR, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(ASSET_DIST_DIR, filename, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = ASSET_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/')
 def index():
     if 'user_id' in session:
@@ -645,7 +1500,7 @@ def register():
         cursor = db.cursor()
         
         try:
-            hashed_password = generate_password_hash(password)
+            hashed_password = hash_password(password)
             cursor.execute(
                 'INSERT INTO users (name, email, password) VALUES (?, ?, ?)',
                 (name, email, hashed_password)
@@ -671,11 +1526,18 @@ def login():
         
         db = get_db()
         cursor = db.cursor()
-        cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
+        cursor.execute('SELECT id, name, email, password FROM users WHERE email = ?', (email,))
         user = cursor.fetchone()
         db.close()
         
-        if user and check_password_hash(user['password'], password):
+        if user and verify_password(user['password'], password):
+            # Transparently upgrade hashes written with an older method or cost
+            if needs_rehash(user['password']):
+                new_hash = hash_password(password)
+                db = get_db()
+                db.execute('UPDATE users SET password = ? WHERE id = ?', (new_hash, user['id']))
+                db.commit()
+                db.close()
             session['user_id'] = user['id']
             session['user_name'] = user['name']
             session['user_email'] = user['email']
@@ -690,17 +1552,26 @@ def login():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    db = get_db()
-    cursor = db.cursor()
-    # Fetch records from the last 3 months
-    cursor.execute(
-        "SELECT * FROM bmi_records WHERE patient_id = ? AND date >= date('now', '-3 months') ORDER BY date DESC",
-        (session['user_id'],)
-    )
-    records = cursor.fetchall()
-    db.close()
+    db = get_db(session['user_id'])
+    since_ms = months_ago_ms(3)
+    
+    def render_records():
+        # Fetch records from the last 3 months
+        records = db.execute(
+            'SELECT * FROM bmi_records WHERE patient_id = ? AND date_ms >= ? ORDER BY date_ms DESC',
+            (session['user_id'], since_ms)
+        ).fetchall()
+        return get_template_attribute('_patient_fragments.html', 'records_table')(records)
+    
+    try:
+        # The window start only moves at midnight UTC, so it is part of the key like the version
+        key = ('dashboard', ETAG_VERSION, session['user_id'], shard_for(session['user_id']),
+               patient_version(db, session['user_id']), since_ms)
+        records_fragment = patient_fragments.get_or_render(key, render_records)
+    finally:
+        db.close()
     
-    return render_template('dashboard.html', records=records)
+    return render_template('dashboard.html', records_fragment=records_fragment)
 
 @app.route('/bmi', methods=['GET', 'POST'])
 @login_required
@@ -732,29 +1603,14 @@ def bmi_calculator():
             
             height_m = height_cm / 100
             bmi = round(weight_kg / (height_m * height_m), 2)
-            category = get_bmi_category(bmi)
+            category = get_bmi_category(bmi, age_int, gender)
             
-            db = get_db()
-            cursor = db.cursor()
-            cursor.execute(
-                'INSERT INTO bmi_records (patient_id, age, gender, height, weight, bmi, category) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                (session['user_id'], age_int, gender, height_cm, weight_kg, bmi, category)
+            created_ms = now_ms()
+            record_id = save_bmi_record(
+                (session['user_id'], age_int, gender, height_cm, weight_kg, bmi, category, created_ms)
             )
-            db.commit()
-            record_id = cursor.lastrowid
-            db.close()
             
-            date_str = get_ist_now().strftime('%Y-%m-%d %H:%M:%S')
-            pdf_path = generate_pdf(
-                session['user_name'],
-                session['user_id'],
-                height_cm,
-                weight_kg,
-                bmi,
-                category,
-                date_str,
-                gender=gender
-            )
+            date_str = format_ist(created_ms, '%Y-%m-%d %H:%M:%S')
             
             result_data = {
                 'success': True,
@@ -763,8 +1619,7 @@ def bmi_calculator():
                 'height': height_cm,
                 'weight': weight_kg,
                 'date': date_str,
-                'record_id': record_id,
-                'pdf_path': pdf_path
+                'record_id': record_id
             }
             
             return jsonify(result_data), 201
@@ -783,32 +1638,36 @@ def bmi_calculator():
 @app.route('/result/<int:record_id>')
 @login_required
 def result(record_id):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute(
-        'SELECT * FROM bmi_records WHERE id = ? AND patient_id = ?',
-        (record_id, session['user_id'])
-    )
-    record = cursor.fetchone()
+    db = get_db(session['user_id'])
+    record = fetch_record(db, record_id, session['user_id'])
     db.close()
     
     if not record:
         return redirect(url_for('dashboard'))
     
-    advice = get_health_advice(record['category'])
-    formatted_date = format_date_display(record['date'])
-    return render_template('result.html', record=record, advice=advice, formatted_date=formatted_date)
+    etag = make_etag('result', session.get('user_name'), *tuple(record))
+    last_modified = datetime.fromtimestamp(record['date_ms'] / 1000, timezone.utc) if record['date_ms'] else None
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    
+    def render_summary():
+        advice = get_health_advice(record['category'])
+        formatted_date = format_ist(record['date_ms'])
+        return get_template_attribute('_patient_fragments.html', 'result_summary')(record, advice, formatted_date)
+    
+    # Readings never change once written, and the ETag already hashes every column of the row
+    # plus ETAG_VERSION, so it identifies the fragment exactly without a version lookup
+    summary = patient_fragments.get_or_render(('result', session['user_id'], record_id, etag), render_summary)
+    response = app.make_response(render_template('result.html', record=record, summary=summary))
+    return set_cache_headers(response, etag, last_modified)
 
 @app.route('/send-email/<int:record_id>')
 @login_required
+@rate_limited('email')
 def send_email_route(record_id):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute(
-        'SELECT * FROM bmi_records WHERE id = ? AND patient_id = ?',
-        (record_id, session['user_id'])
-    )
-    record = cursor.fetchone()
+    db = get_db(session['user_id'])
+    record = fetch_record(db, record_id, session['user_id'])
     db.close()
     
     if not record:
@@ -821,7 +1680,7 @@ def send_email_route(record_id):
         record['weight'],
         record['bmi'],
         record['category'],
-        record['date'],
+        format_ist(record['date_ms']),
         gender=record['gender']
     )
     
@@ -841,71 +1700,65 @@ def send_email_route(record_id):
 @app.route('/create-invoice/<int:record_id>', methods=['POST'])
 @login_required
 def create_invoice(record_id):
-    db = get_db()
+    db = get_db(session['user_id'])
     cursor = db.cursor()
-    
-    cursor.execute(
-        'SELECT * FROM bmi_records WHERE id = ? AND patient_id = ?',
-        (record_id, session['user_id'])
-    )
-    record = cursor.fetchone()
+    record = fetch_record(db, record_id, session['user_id'])
     
     if not record:
         db.close()
         return jsonify({'success': False, 'error': 'Record not found'}), 404
     
-    consultation_fee = 500.00
-    bmi_assessment_fee = 300.00
-    health_report_fee = 200.00
-    total_amount = consultation_fee + bmi_assessment_fee + health_report_fee
+    # One invoice per reading: View Report and Download Report both land here, and a repeat
+    # click returns the invoice already issued instead of billing the reading again
+    existing = fetch_record_invoice(db, record_id, session['user_id'])
+    if existing is None:
+        # Holds the write lock from the check to the insert, so two concurrent clicks cannot both insert
+        db.execute('BEGIN IMMEDIATE')
+        existing = db.execute(RECORD_INVOICE_QUERY.format('main'), (record_id, session['user_id'])).fetchone()
+    if existing is not None:
+        db.rollback()
+        db.close()
+        return jsonify({
+            'success': True,
+            'invoice_id': existing['id'],
+            'invoice_number': existing['invoice_number'],
+            'invoice_date': existing['invoice_date'],
+            'total_amount': existing['total_amount']
+        }), 200
     
-    ist_now = get_ist_now()
-    invoice_number = f"INV-{session['user_id']}-{record_id}-{ist_now.strftime('%Y%m%d%H%M%S')}"
-    payment_terms = "Due within 30 days"
-    invoice_date = ist_now.strftime('%Y-%m-%d %H:%M:%S')
+    total_amount = CONSULTATION_FEE + BMI_ASSESSMENT_FEE + HEALTH_REPORT_FEE
+    # Always stamped at creation, so the number, date and revenue day are never backdated
+    invoice_ms = now_ms()
+    invoice_number, invoice_date = invoice_identity(session['user_id'], record_id, invoice_ms)
     
     try:
         cursor.execute('''
             INSERT INTO invoices 
             (invoice_number, patient_id, record_id, consultation_fee, bmi_assessment_fee, 
-             health_report_fee, total_amount, payment_terms, invoice_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (invoice_number, session['user_id'], record_id, consultation_fee, 
-              bmi_assessment_fee, health_report_fee, total_amount, payment_terms, invoice_date))
+             health_report_fee, total_amount, payment_terms, invoice_date, invoice_date_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (invoice_number, session['user_id'], record_id, CONSULTATION_FEE, 
+              BMI_ASSESSMENT_FEE, HEALTH_REPORT_FEE, total_amount, PAYMENT_TERMS, invoice_date, invoice_ms))
+        analytics.record_invoice(db, total_amount, invoice_ms)
         db.commit()
         invoice_id = cursor.lastrowid
         
-        invoice_path = generate_invoice_pdf(
-            session['user_name'],
-            session['user_id'],
-            invoice_number,
-            record['height'],
-            record['weight'],
-            record['bmi'],
-            record['category'],
-            consultation_fee,
-            bmi_assessment_fee,
-            health_report_fee,
-            total_amount,
-            payment_terms,
-            invoice_date,
-            age=record['age'],
-            gender=record['gender']
-        )
+        # Without speculation /download-invoice renders the PDF on demand and /report/<id> never
+        # needs it. With speculation the render starts in the background now, and
+        # /download-invoice claims it through ensure_invoice_pdf.
+        if SPECULATIVE_INVOICES:
+            invoice = fetch_invoice(db, invoice_id, session['user_id'])
+            etag = invoice_pdf_etag(invoice, session['user_name'])
+            patient_name, patient_id = session['user_name'], session['user_id']
+            invoice_speculator.start(('invoice', invoice_id), {'etag': etag},
+                                     lambda: render_invoice_pdf(invoice, patient_name, patient_id))
         
         return jsonify({
             'success': True,
             'invoice_id': invoice_id,
             'invoice_number': invoice_number,
             'invoice_date': invoice_date,
-            'patient_name': session['user_name'],
-            'age': record['age'],
-            'height': record['height'],
-            'weight': record['weight'],
-            'bmi': record['bmi'],
-            'category': record['category'],
-            'total_amount': total_amount,
-            'invoice_path': invoice_path
+            'total_amount': total_amount
         }), 201
     
     except Exception as e:
@@ -916,17 +1769,10 @@ def create_invoice(record_id):
 
 @app.route('/send-invoice/<int:invoice_id>', methods=['POST'])
 @login_required
+@rate_limited('email')
 def send_invoice(invoice_id):
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute(
-        'SELECT i.*, b.age, b.gender, b.height, b.weight, b.bmi, b.category FROM invoices i '
-        'JOIN bmi_records b ON i.record_id = b.id '
-        'WHERE i.id = ? AND i.patient_id = ?',
-        (invoice_id, session['user_id'])
-    )
-    invoice = cursor.fetchone()
+    db = get_db(session['user_id'])
+    invoice = fetch_invoice(db, invoice_id, session['user_id'])
     db.close()
     
     if not invoice:
@@ -966,45 +1812,63 @@ def send_invoice(invoice_id):
 @app.route('/download-invoice/<int:invoice_id>')
 @login_required
 def download_invoice(invoice_id):
-    db = get_db()
-    cursor = db.cursor()
+    db = get_db(session['user_id'])
+    invoice = fetch_invoice(db, invoice_id, session['user_id'])
+    db.close()
     
-    cursor.execute(
-        'SELECT i.*, b.age, b.gender, b.height, b.weight, b.bmi, b.category FROM invoices i '
-        'JOIN bmi_records b ON i.record_id = b.id '
-        'WHERE i.id = ? AND i.patient_id = ?',
-        (invoice_id, session['user_id'])
-    )
-    invoice = cursor.fetchone()
+    if not invoice:
+        return "Invoice not found", 404
+    
+    etag = invoice_pdf_etag(invoice, session.get('user_name'))
+    last_modified = datetime.fromtimestamp(invoice['invoice_date_ms'] / 1000, timezone.utc) if invoice['invoice_date_ms'] else None
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    
+    # Admitted only past the 304 branch, so revalidations never spend a PDF token
+    with rate_limiter.admit('pdf', session.get('user_id')):
+        invoice_path = ensure_invoice_pdf(invoice, session['user_name'], session['user_id'], etag)
+        response = deliver_pdf(invoice_path, f"Prescription_{invoice['invoice_number']}.pdf", last_modified)
+    return set_cache_headers(response, etag, last_modified)
+
+def render_report_section(section, invoice):
+    # Static sections are shared by every report; the rest are keyed by the (immutable) invoice
+    if section['key'] in invoice_report.STATIC_SECTIONS:
+        key = (section['key'], ETAG_VERSION)
+    else:
+        key = (section['key'], ETAG_VERSION, session['user_id'], invoice['id'], invoice['invoice_number'], session.get('user_name'))
+    return report_fragments.get_or_render(key, lambda: get_template_attribute('_report_sections.html', section['key'])(section))
+
+@app.route('/report/<int:invoice_id>')
+@login_required
+def invoice_report_view(invoice_id):
+    db = get_db(session['user_id'])
+    invoice = fetch_invoice(db, invoice_id, session['user_id'])
     db.close()
     
     if not invoice:
         return "Invoice not found", 404
     
-    invoice_path = generate_invoice_pdf(
+    etag = make_etag('invoice-report', session.get('user_name'), *tuple(invoice))
+    last_modified = datetime.fromtimestamp(invoice['invoice_date_ms'] / 1000, timezone.utc) if invoice['invoice_date_ms'] else None
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    
+    sections = invoice_report.build_sections(
         session['user_name'],
-        session['user_id'],
         invoice['invoice_number'],
+        invoice['invoice_date'],
         invoice['height'],
         invoice['weight'],
         invoice['bmi'],
         invoice['category'],
-        invoice['consultation_fee'],
-        invoice['bmi_assessment_fee'],
-        invoice['health_report_fee'],
-        invoice['total_amount'],
-        invoice['payment_terms'],
-        invoice['invoice_date'],
         age=invoice['age'],
         gender=invoice['gender']
     )
-    
-    return send_file(
-        invoice_path, 
-        mimetype='application/pdf',
-        as_attachment=True, 
-        download_name=f"Prescription_{invoice['invoice_number']}.pdf"
-    )
+    rendered = [render_report_section(section, invoice) for section in sections]
+    response = app.make_response(render_template('report.html', fragments=rendered, invoice=invoice))
+    return set_cache_headers(response, etag, last_modified)
 
 @app.route('/send-invoice-formsubmit', methods=['POST'])
 @login_required
@@ -1016,16 +1880,8 @@ def send_invoice_formsubmit():
     if not recipient_email:
         return jsonify({'success': False, 'error': 'Email address not found. Please log in again.'}), 400
     
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute(
-        'SELECT i.*, b.age, b.gender, b.height, b.weight, b.bmi, b.category FROM invoices i '
-        'JOIN bmi_records b ON i.record_id = b.id '
-        'WHERE i.id = ? AND i.patient_id = ?',
-        (invoice_id, session['user_id'])
-    )
-    invoice = cursor.fetchone()
+    db = get_db(session['user_id'])
+    invoice = fetch_invoice(db, invoice_id, session['user_id'])
     db.close()
     
     if not invoice:
@@ -1061,6 +1917,124 @@ def send_invoice_formsubmit():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/history/<metric>')
+@login_required
+def history_series(metric):
+    if metric not in history.METRICS:
+        return jsonify({'success': False, 'error': f'Unknown metric: {metric}'}), 404
+    
+    points = min(max(request.args.get('points', 200, type=int), 3), HISTORY_MAX_POINTS)
+    db = get_db(session['user_id'])
+    try:
+        archive.attach_archive(db, archive_database_for(session['user_id']))
+        series = history.get_series(db, history_cache, session['user_id'], metric)
+    finally:
+        db.close()
+    
+    x, y = history.downsample(series, points)
+    if request.args.get('format') == 'binary':
+        return app.response_class(history.to_binary_payload(x, y), mimetype='application/octet-stream')
+    return jsonify(history.to_json_payload(metric, len(series[0]), x, y))
+
+@app.route('/api/analytics')
+@admin_required
+def analytics_report():
+    weeks = min(max(request.args.get('weeks', 12, type=int), 1), 104)
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    
+    def build():
+        parts = fan_out_shards(lambda db: analytics.shard_report(db, weeks=weeks, days=days), connect=get_reporting_db)
+        return analytics.build_report(parts)
+    
+    body = analytics_cache.get_or_build((weeks, days), build)
+    response = app.response_class(body, mimetype='application/json')
+    response.cache_control.private = True
+    response.cache_control.max_age = ANALYTICS_CACHE_SECONDS
+    return response
+
+@app.route('/api/metrics')
+@admin_required
+def metrics_report():
+    return app.response_class(metrics.render_text(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/memory')
+@admin_required
+def memory_report():
+    # ?dump=1 also writes the diff to MEMORY_PROFILE_DIR; ?reset=1 starts a new baseline afterwards
+    report = memory_profiler.report(request.args.get('top', type=int))
+    if request.args.get('dump') == '1':
+        report['dump_path'] = memory_profiler.dump('api')
+    if request.args.get('reset') == '1' and MEMORY_PROFILING:
+        memory_profiler.reset_baseline()
+    return jsonify({'success': True, 'memory': report})
+
+@app.route('/forgot-password')
+def forgot_password():
+    return render_template('forgot_password.html')
+
+@app.route('/send-reset-email', methods=['POST'])
+def send_reset_email():
+    data = request.get_json() if request.is_json else request.form
+    email = data.get('email', '').strip()
+    
+    if not email:
+        return jsonify({'success': False, 'errors': ['Email is required']}), 400
+    
+    # Unknown and throttled addresses get exactly the same answer as real ones, and nothing that
+    # depends on whether the account exists happens before the response
+    generic = {'success': True, 'message': 'If an account exists for that email, a reset link is on its way.'}
+    try:
+        with rate_limiter.admit('reset', reset_tokens.token_digest(email.lower())):
+            pass
+    except ratelimit.RateLimited as e:
+        if e.scope != 'user':
+            raise
+        metrics.inc('password_reset_requests_total', outcome='throttled')
+        return jsonify(generic), 200
+    
+    link_base = APP_BASE_URL + url_for('reset_password') if APP_BASE_URL else url_for('reset_password', _external=True)
+    reset_mailer.submit(issue_reset_link, email, link_base)
+    return jsonify(generic), 200
+
+@app.route('/reset-password')
+def reset_password():
+    return render_template('reset_password.html')
+
+@app.route('/reset-password', methods=['POST'])
+def reset_password_submit():
+    data = request.get_json() if request.is_json else request.form
+    token = (data.get('token') or '').strip()
+    new_password = data.get('new_password', '').strip()
+    confirm_password = data.get('confirm_password', '').strip()
+    
+    errors = []
+    if new_password != confirm_password:
+        errors.append('Passwords do not match')
+    if len(new_password) < 6:
+        errors.append('Password must be at least 6 characters')
+    if errors:
+        return jsonify({'success': False, 'errors': errors}), 400
+    
+    invalid = jsonify({'success': False, 'errors': ['This reset link is invalid or has expired. Please request a new one.']}), 400
+    db = get_db()
+    try:
+        row = reset_tokens.find_valid(db, token, now_ms())
+        if row is None:
+            return invalid
+        # Hash before claiming the token so the write lock is not held while the hash runs
+        hashed_password = hash_password(new_password)
+        if not reset_tokens.consume(db, token, now_ms()):
+            db.rollback()
+            return invalid
+        db.execute('UPDATE users SET password = ? WHERE id = ?', (hashed_password, row['user_id']))
+        db.execute('DELETE FROM password_reset_tokens WHERE user_id = ?', (row['user_id'],))
+        db.commit()
+    finally:
+        db.close()
+    
+    metrics.inc('password_reset_requests_total', outcome='completed')
+    return jsonify({'success': True, 'message': 'Password updated. Redirecting to login...'}), 200
+
 @app.route('/logout')
 def logout():
     session.clear()
@@ -0,0 +1,98 @@
+import os
+import sqlite3
+
+ARCHIVED_TABLES = ('bmi_records', 'invoices')
+
+def is_attached(db):
+    return any(row[1] == 'archive' for row in db.execute('PRAGMA database_list'))
+
+def attach_archive(db, archive_path, create=False):
+    # Returns False when there is nothing archived yet and create is not requested
+    if is_attached(db):
+        return True
+    if not create and not os.path.exists(archive_path):
+        return False
+    db.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+    if create:
+        ensure_archive_tables(db)
+    return True
+
+def with_archive(db, table, columns):
+    # FROM source over hot and archived rows of `table` once the archive is attached. Archived rows
+    # whose id is still in main are skipped, so a reporting snapshot taken before the last archive
+    # run does not count them twice.
+    if not is_attached(db):
+        return f'main.{table}'
+    return (f'(SELECT {columns} FROM main.{table} UNION ALL SELECT {columns} FROM archive.{table} AS a '
+            f'WHERE NOT EXISTS (SELECT 1 FROM main.{table} AS m WHERE m.id = a.id))')
+
+def _columns(db, schema, table):
+    return [row[1] for row in db.execute(f'PRAGMA {schema}.table_info({table})')]
+
+def ensure_archive_tables(db):
+    # Archive tables mirror the hot columns (without constraints) and pick up columns added later
+    for table in ARCHIVED_TABLES:
+        hot_columns = _columns(db, 'main', table)
+        archive_columns = _columns(db, 'archive', table)
+        if not archive_columns:
+            db.execute(f'CREATE TABLE archive.{table} AS SELECT * FROM main.{table} WHERE 0')
+        else:
+            for column in hot_columns:
+                if column not in archive_columns:
+                    db.execute(f'ALTER TABLE archive.{table} ADD COLUMN {column}')
+    db.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_bmi_records_patient ON bmi_records (patient_id, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_invoices_patient ON invoices (patient_id, id)')
+    db.commit()
+
+def archive_old_records(db, archive_path, cutoff_ms, batch_size=1000):
+    # Moves readings older than cutoff_ms, together with their invoices, in short batches so
+    # the write lock on the hot database is only held briefly
+    attach_archive(db, archive_path, create=True)
+    record_columns = ', '.join(_columns(db, 'main', 'bmi_records'))
+    invoice_columns = ', '.join(_columns(db, 'main', 'invoices'))
+    moved_records = moved_invoices = 0
+
+    while True:
+        ids = [row[0] for row in db.execute(
+            'SELECT id FROM main.bmi_records WHERE date_ms < ? ORDER BY id LIMIT ?',
+            (cutoff_ms, batch_size)
+        )]
+        if not ids:
+            break
+        placeholders = ', '.join('?' * len(ids))
+        try:
+            db.execute(f'INSERT INTO archive.bmi_records ({record_columns}) '
+                       f'SELECT {record_columns} FROM main.bmi_records WHERE id IN ({placeholders})', ids)
+            cursor = db.execute(f'INSERT INTO archive.invoices ({invoice_columns}) '
+                                f'SELECT {invoice_columns} FROM main.invoices WHERE record_id IN ({placeholders})', ids)
+            moved_invoices += cursor.rowcount
+            db.execute(f'DELETE FROM main.invoices WHERE record_id IN ({placeholders})', ids)
+            db.execute(f'DELETE FROM main.bmi_records WHERE id IN ({placeholders})', ids)
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+            raise
+        moved_records += len(ids)
+
+    return moved_records, moved_invoices
+
+def size_report(db):
+    # Bytes per table from the dbstat virtual table when SQLite is built with it, else row counts
+    report = {}
+    page_size = db.execute('PRAGMA main.page_size').fetchone()[0]
+    page_count = db.execute('PRAGMA main.page_count').fetchone()[0]
+    free_pages = db.execute('PRAGMA main.freelist_count').fetchone()[0]
+    report['main_file_bytes'] = page_size * page_count
+    report['main_free_bytes'] = page_size * free_pages
+    for table in ARCHIVED_TABLES:
+        entry = {'rows': db.execute(f'SELECT COUNT(*) FROM main.{table}').fetchone()[0]}
+        try:
+            entry['bytes'] = db.execute(
+                "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name = ? OR name IN "
+                "(SELECT name FROM sqlite_master WHERE tbl_name = ? AND type = 'index')",
+                (table, table)
+            ).fetchone()[0]
+        except sqlite3.OperationalError:
+            pass
+        report[table] = entry
+    return report
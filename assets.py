@@ -0,0 +1,94 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; only .gz variants are built without it
+    brotli = None
+
+# Files the pipeline processes; anything else under static/ is served as before
+ASSET_EXTENSIONS = ('.css', '.js')
+MANIFEST_NAME = 'manifest.json'
+
+_CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*.*?\*/)', re.S)
+_CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+
+def minify_css(text):
+    # Strings are kept verbatim; comments are dropped and whitespace collapsed everywhere else
+    parts = []
+    for i, part in enumerate(_CSS_TOKENS.split(text)):
+        if i % 2:
+            if not part.startswith('/*'):
+                parts.append(part)
+            continue
+        part = re.sub(r'\s+', ' ', part)
+        parts.append(_CSS_PUNCTUATION.sub(r'\1', part))
+    return ''.join(parts).replace(';}', '}').strip()
+
+def minify_js(text):
+    # Deliberately conservative: indentation, blank lines and whole-line // comments only,
+    # keeping line breaks so automatic semicolon insertion behaves exactly as before
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+def _write_once(path, data):
+    # Hashed names never change content, so an existing file is already correct
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def build_assets(static_dir, dist_dir):
+    # Minifies, fingerprints and precompresses every CSS/JS file under static_dir into dist_dir.
+    # Returns {'css/style.css': 'css/style.<hash>.css', ...} and writes it to manifest.json.
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root).startswith(os.path.abspath(dist_dir)):
+            continue
+        for name in sorted(files):
+            base, ext = os.path.splitext(name)
+            if ext not in ASSET_EXTENSIONS:
+                continue
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            with open(source, encoding='utf-8') as f:
+                data = MINIFIERS[ext](f.read()).encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            hashed = f'{os.path.dirname(logical) + "/" if os.path.dirname(logical) else ""}{base}.{digest}{ext}'
+            target = os.path.join(dist_dir, hashed)
+            _write_once(target, data)
+            _write_once(target + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write_once(target + '.br', brotli.compress(data, quality=11))
+            manifest[logical] = hashed
+    os.makedirs(dist_dir, exist_ok=True)
+    _write_manifest(os.path.join(dist_dir, MANIFEST_NAME), manifest)
+    return manifest
+
+def _write_manifest(path, manifest):
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+def clean_dist(dist_dir, manifest):
+    # Removes fingerprinted files that the current manifest no longer references
+    keep = {MANIFEST_NAME}
+    for hashed in manifest.values():
+        keep.update((hashed, hashed + '.gz', hashed + '.br'))
+    removed = 0
+    for root, dirs, files in os.walk(dist_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.relpath(path, dist_dir).replace(os.sep, '/') not in keep:
+                os.remove(path)
+                removed += 1
+    return removed
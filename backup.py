@@ -0,0 +1,157 @@
+import os
+import glob
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import shards
+
+try:
+    import fcntl
+except ImportError:  # Windows: every worker may run the scheduler
+    fcntl = None
+
+class BackupTimeout(Exception):
+    pass
+
+def backup_database(source_path, dest_path, pages=256, sleep=0.005, max_backoff=2.0, timeout=600):
+    # Online backup in small page steps: the source is only locked while each step copies,
+    # and writers get the database back for `sleep` seconds between steps.
+    # SQLite restarts a stepped backup whenever another connection writes to the source. After
+    # each restart we wait out the write burst (doubling up to max_backoff) and start over, and
+    # after `timeout` seconds we give up and keep the previous backup rather than locking writers
+    # out for a one-step copy. A source in WAL mode is copied in one step: there a step only holds
+    # a read snapshot, so writers carry on while it copies.
+    os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+    partial_path = dest_path + '.partial'
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(partial_path)
+    wal = source.execute('PRAGMA journal_mode').fetchone()[0].lower() == 'wal'
+    deadline = time.monotonic() + timeout
+    state = {'steps': 0, 'restarts': 0, 'remaining': None}
+
+    def progress(status, remaining, total):
+        state['steps'] += 1
+        delay = sleep
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            delay = min(sleep * 2 ** state['restarts'], max_backoff)
+        state['remaining'] = remaining
+        if remaining:
+            if time.monotonic() + delay > deadline:
+                raise BackupTimeout(f"{source_path} kept changing for {timeout}s ({state['restarts']} restarts)")
+            time.sleep(delay)
+
+    try:
+        source.backup(target, pages=-1 if wal else pages, progress=progress)
+        if wal:
+            # Backups and snapshots are plain single files, whatever mode the source runs in
+            target.execute('PRAGMA journal_mode=DELETE')
+    except BaseException:
+        target.close()
+        os.remove(partial_path)
+        raise
+    finally:
+        target.close()
+        source.close()
+    if state['restarts']:
+        print(f"DEBUG: Backup of {source_path} restarted {state['restarts']} times")
+    # Readers of dest_path never see a half-written file
+    os.replace(partial_path, dest_path)
+    return state['steps']
+
+def archive_path(dest_path):
+    # Where the archive files of a backup or snapshot go: database-<stamp>.archive.db, ...
+    root, ext = os.path.splitext(dest_path)
+    return f'{root}.archive{ext}'
+
+def backup_shards(source_paths, dest_path, archive_paths=(), pages=256, sleep=0.005):
+    # Shard i of dest_path follows the same naming as the live shards (database.shard1.db, ...);
+    # archive_paths are (index, path) pairs and land next to it as database.archive.shard1.db, ...
+    steps = 0
+    for index, source_path in enumerate(source_paths):
+        steps += backup_database(source_path, shards.shard_path(dest_path, index), pages=pages, sleep=sleep)
+    for index, source_path in archive_paths:
+        steps += backup_database(source_path, shards.shard_path(archive_path(dest_path), index), pages=pages, sleep=sleep)
+    return steps
+
+def prune_backups(backup_dir, keep):
+    # Keeps the newest `keep` backups, each with all of its shard and archive files
+    backups = sorted(path for path in glob.glob(os.path.join(backup_dir, 'database-*.db'))
+                     if '.shard' not in path and '.archive' not in path)
+    for path in backups[:-keep] if keep > 0 else []:
+        for _, shard_file in shards.existing_shard_paths(path) + shards.existing_shard_paths(archive_path(path)):
+            os.remove(shard_file)
+
+def run_scheduled_backup(source_paths, archive_paths, backup_dir, snapshot_path, keep, pages, sleep):
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    backup_path = os.path.join(backup_dir, f'database-{stamp}.db')
+    backup_shards(source_paths, backup_path, archive_paths, pages=pages, sleep=sleep)
+    prune_backups(backup_dir, keep)
+    if snapshot_path:
+        backup_shards(source_paths, snapshot_path, archive_paths, pages=pages, sleep=sleep)
+    return backup_path
+
+def open_snapshot(snapshot_path):
+    # Read-only connection for reporting/export jobs; None when no snapshot has been taken yet
+    if not snapshot_path or not os.path.exists(snapshot_path):
+        return None
+    db = sqlite3.connect(f'file:{snapshot_path}?mode=ro', uri=True)
+    db.row_factory = sqlite3.Row
+    return db
+
+class BackupScheduler:
+    # Background thread taking a backup (and refreshing the snapshot) every interval.
+    # A lock file makes sure only one gunicorn worker runs it.
+    def __init__(self, source_paths, backup_dir, snapshot_path, interval_minutes, keep=7, pages=256, sleep=0.005,
+                 archive_paths=()):
+        # source_paths / archive_paths may be callables returning the shard files (archive ones as
+        # (index, path) pairs); they are evaluated on every run
+        self.source_paths = source_paths
+        self.archive_paths = archive_paths
+        self.backup_dir = backup_dir
+        self.snapshot_path = snapshot_path
+        self.interval = interval_minutes * 60
+        self.keep = keep
+        self.pages = pages
+        self.sleep = sleep
+        self.last_backup = None
+        self._thread = None
+        self._lock_file = None
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0 or not self._acquire_lock():
+            return False
+        self._thread = threading.Thread(target=self._run, name='sqlite-backup', daemon=True)
+        self._thread.start()
+        return True
+
+    def _acquire_lock(self):
+        if fcntl is None:
+            return True
+        os.makedirs(self.backup_dir, exist_ok=True)
+        self._lock_file = open(os.path.join(self.backup_dir, '.scheduler.lock'), 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            return False
+
+    def _run(self):
+        while True:
+            try:
+                source_paths = self.source_paths() if callable(self.source_paths) else self.source_paths
+                archive_paths = self.archive_paths() if callable(self.archive_paths) else self.archive_paths
+                self.last_backup = run_scheduled_backup(
+                    source_paths, archive_paths, self.backup_dir, self.snapshot_path, self.keep, self.pages, self.sleep
+                )
+                print(f"DEBUG: Backup written to {self.last_backup}")
+            except Exception as e:
+                print(f"DEBUG: Scheduled backup failed: {e}")
+            time.sleep(self.interval)
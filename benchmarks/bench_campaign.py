@@ -0,0 +1,140 @@
+# Runs `flask send-campaign` against a local SMTP stand-in and compares it with opening one
+# SMTP connection per message (what calling send_email in a loop does). The stand-in adds a
+# fixed delay to each new session to mimic TLS + login against a real provider.
+# Then checks that recipients the server refused are retried when the campaign is re-run, and
+# that patients whose readings have all been archived are still found as due.
+# Usage: python benchmarks/bench_campaign.py [patients] [connect_delay_ms]
+import os
+import smtplib
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class StandInSMTP(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, connect_delay):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.connect_delay = connect_delay
+        self.sessions = 0
+        self.messages = 0
+        self.refuse = set()
+        self.lock = threading.Lock()
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    # Just enough of RFC 5321 for smtplib: no auth, no TLS, every message accepted
+    def handle(self):
+        with self.server.lock:
+            self.server.sessions += 1
+        time.sleep(self.server.connect_delay)
+        self.reply('220 stand-in ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().upper()
+            if command.startswith('EHLO'):
+                self.reply('250-stand-in', '250 8BITMIME')
+            elif command.startswith('RCPT TO:') and command[8:].strip('<> ').lower() in self.server.refuse:
+                self.reply('550 mailbox unavailable')
+            elif command == 'DATA':
+                self.reply('354 end with .')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                with self.server.lock:
+                    self.server.messages += 1
+                self.reply('250 queued')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+    def reply(self, *lines):
+        self.wfile.write(''.join(f'{line}\r\n' for line in lines).encode('ascii'))
+
+def seed(bmi_app, patients):
+    db = bmi_app.get_db()
+    old_ms = bmi_app.now_ms() - 90 * 86400000
+    for i in range(patients):
+        user_id = db.execute('INSERT INTO users (name, email, password) VALUES (?, ?, ?)',
+                             (f'Patient {i}', f'patient{i}@example.com', 'x')).lastrowid
+        db.commit()
+        shard_db = bmi_app.get_db(user_id)
+        shard_db.execute('INSERT INTO bmi_records (patient_id, age, gender, height, weight, bmi, category, date_ms) '
+                         'VALUES (?, 40, ?, 170, 80, 27.68, ?, ?)', (user_id, 'Male', 'Overweight', old_ms + i))
+        shard_db.commit()
+        shard_db.close()
+    db.close()
+
+def main():
+    import app as bmi_app
+
+    patients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    connect_delay = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+
+    server = StandInSMTP(connect_delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bmi_app.DATABASE = os.path.join(tmp, 'bench.db')
+        bmi_app.TEMP_PDF_DIR = tmp
+        bmi_app.ARCHIVE_DATABASE = os.path.join(tmp, 'archive.db')
+        bmi_app.init_db()
+        seed(bmi_app, patients)
+        runner = bmi_app.app.test_cli_runner()
+        common = ['--smtp-host', '127.0.0.1', '--smtp-port', str(port), '--no-ssl', '--rate', '0']
+
+        for kind in ('reminder', 'report'):
+            server.sessions = server.messages = 0
+            start = time.perf_counter()
+            result = runner.invoke(args=['send-campaign', f'bench-{kind}', '--kind', kind] + common)
+            elapsed = time.perf_counter() - start
+            print(result.output.strip().splitlines()[-1])
+            print(f"  pooled {kind:<8}: {server.messages} messages, {server.sessions} sessions, "
+                  f"{elapsed:.2f}s ({server.messages / elapsed:.0f} msg/s)")
+
+        result = runner.invoke(args=['send-campaign', 'bench-reminder', '--kind', 'reminder'] + common)
+        print(f"  re-run of a finished campaign: {result.output.strip().splitlines()[-1]}")
+
+        db = bmi_app.get_db()
+        users = db.execute('SELECT id, name, email FROM users ORDER BY id').fetchall()
+        due = bmi_app.due_campaign_recipients(users, bmi_app.now_ms())
+        db.close()
+        server.sessions = server.messages = 0
+        start = time.perf_counter()
+        for user, reading in due:
+            message = bmi_app.render_campaign_email('reminder', 'noreply@localhost', user, reading)
+            with smtplib.SMTP('127.0.0.1', port) as connection:
+                connection.send_message(message)
+        elapsed = time.perf_counter() - start
+        print(f"  per-message reminder: {server.messages} messages, {server.sessions} sessions, "
+              f"{elapsed:.2f}s ({server.messages / elapsed:.0f} msg/s)")
+
+        server.refuse = {f'patient{i}@example.com' for i in range(0, patients, 7)}
+        result = runner.invoke(args=['send-campaign', 'bench-retry', '--kind', 'reminder'] + common)
+        print(f"  with {len(server.refuse)} recipients refused: {result.output.strip().splitlines()[-1]}")
+        server.refuse = set()
+        result = runner.invoke(args=['send-campaign', 'bench-retry', '--kind', 'reminder'] + common)
+        summary = result.output.strip().splitlines()[-1]
+        print(f"  re-run once they are accepted: {summary}")
+        assert summary.startswith(f'bench-retry: sent {len(range(0, patients, 7))}, failed 0'), 'refused recipients were not retried'
+
+        # Every seeded reading is 90 days old, so a 30-day window leaves none of them hot
+        runner.invoke(args=['archive-old-records', '--days', '30'])
+        result = runner.invoke(args=['send-campaign', 'bench-archived', '--kind', 'reminder', '--dry-run',
+                                     '--due-days', '1'] + common)
+        summary = result.output.strip().splitlines()[-1]
+        print(f"  after archiving every reading: {summary}")
+        assert f'would send {patients},' in summary, 'patients with only archived readings were skipped'
+
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
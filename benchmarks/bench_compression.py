@@ -0,0 +1,54 @@
+# Bytes on the wire and CPU time per compression level for the dynamic pages and JSON responses
+# (dashboard, result page, /bmi, /create-invoice). Brotli rows are skipped when brotli is missing.
+# Usage: python benchmarks/bench_compression.py [records] [repeats]
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def main():
+    import app as bmi_app
+    import compression
+
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bmi_app.DATABASE = os.path.join(tmp, 'bench.db')
+        bmi_app.TEMP_PDF_DIR = tmp
+        bmi_app.COMPRESSION = False
+        bmi_app.init_db()
+        client = bmi_app.app.test_client()
+        client.post('/register', json={'name': 'Bench', 'email': 'bench@example.com',
+                                       'password': 'bench-password', 'confirm_password': 'bench-password'})
+        client.post('/login', json={'email': 'bench@example.com', 'password': 'bench-password'})
+
+        for i in range(records):
+            bmi_response = client.post('/bmi', json={'age': 20 + i % 50, 'gender': 'Female', 'height': 165, 'weight': 50 + i % 40})
+        record_id = bmi_response.get_json()['record_id']
+        bodies = {
+            'dashboard': client.get('/dashboard').get_data(),
+            'result page': client.get(f'/result/{record_id}').get_data(),
+            '/bmi json': bmi_response.get_data(),
+            '/create-invoice json': client.post(f'/create-invoice/{record_id}').get_data(),
+        }
+
+    encodings = [('gzip', level) for level in (1, 4, 6, 9)]
+    if compression.brotli is not None:
+        encodings += [('br', level) for level in (1, 4, 6, 11)]
+
+    for label, body in bodies.items():
+        print(f"{label}: {len(body)} bytes uncompressed"
+              f"{' (below COMPRESSION_MIN_BYTES, sent as-is)' if len(body) < bmi_app.COMPRESSION_MIN_BYTES else ''}")
+        for encoding, level in encodings:
+            start = time.process_time()
+            for _ in range(repeats):
+                compressed = compression.compress_body(body, encoding, level)
+            cpu = (time.process_time() - start) / repeats
+            print(f"  {encoding:<4} level {level:>2}: {len(compressed):6d} bytes "
+                  f"({len(compressed) / len(body):5.1%}), {cpu * 1e6:7.1f} us CPU")
+
+if __name__ == '__main__':
+    main()
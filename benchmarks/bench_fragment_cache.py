@@ -0,0 +1,63 @@
+# Latency of /dashboard and /result/<id> with the patient fragment cache cold (cleared before every
+# request, i.e. the old render path) and warm, for the per-worker memory store and the shared
+# SQLite store.
+# Usage: python benchmarks/bench_fragment_cache.py [readings] [requests]
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+
+def seed(bmi_app, client, readings):
+    client.post('/register', json={'name': 'Bench Patient', 'email': 'bench@example.com',
+                                   'password': 'secret1', 'confirm_password': 'secret1'})
+    client.post('/login', json={'email': 'bench@example.com', 'password': 'secret1'})
+    db = bmi_app.get_db(1)
+    start_ms = bmi_app.now_ms() - 80 * 86400000
+    db.executemany('INSERT INTO bmi_records (patient_id, age, gender, height, weight, bmi, category, date_ms) '
+                   'VALUES (1, 40, ?, 170, ?, ?, ?, ?)',
+                   [('Male', 60 + i % 40, round((60 + i % 40) / 2.89, 2), 'Normal', start_ms + i * 60000)
+                    for i in range(readings)])
+    db.commit()
+    db.close()
+
+def p50(client, url, requests, before=None):
+    timings = []
+    for _ in range(requests):
+        if before:
+            before()
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, (url, response.status_code)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+def main():
+    import app as bmi_app
+    import fragments
+
+    readings = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bmi_app.DATABASE = os.path.join(tmp, 'bench.db')
+        bmi_app.TEMP_PDF_DIR = tmp
+        bmi_app.init_db()
+        client = bmi_app.app.test_client()
+        seed(bmi_app, client, readings)
+
+        stores = (('memory', fragments.MemoryFragmentStore(1024)),
+                  ('sqlite', fragments.SQLiteFragmentStore(os.path.join(tmp, 'fragments.db'))))
+        for backend, store in stores:
+            bmi_app.patient_fragments.store = store
+            for url in ('/dashboard', f'/result/{readings}'):
+                cold = p50(client, url, requests, bmi_app.patient_fragments.clear)
+                warm = p50(client, url, requests)
+                print(f"{backend:<6} {url:<14}: cold p50 {cold * 1000:6.2f} ms, warm p50 {warm * 1000:6.2f} ms "
+                      f"({cold / warm:.1f}x)")
+
+if __name__ == '__main__':
+    main()
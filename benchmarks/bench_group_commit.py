@@ -0,0 +1,62 @@
+# Compares per-request commits with the group-commit writer for concurrent /bmi inserts.
+# Usage: python benchmarks/bench_group_commit.py [writers] [inserts_per_writer]
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as bmi_app
+from write_queue import GroupCommitWriter
+
+def run_writers(writers, per_writer, save):
+    barrier = threading.Barrier(writers)
+    errors = []
+
+    def worker(patient_id):
+        barrier.wait()
+        for i in range(per_writer):
+            try:
+                save((patient_id, 30, 'Female', 165.0, 60.0 + i % 10, 22.04, 'Normal', bmi_app.now_ms()))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n + 1,)) for n in range(writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, errors
+
+def direct_save(values):
+    db = bmi_app.get_db()
+    try:
+        bmi_app.insert_bmi_record(db, values)
+        db.commit()
+    finally:
+        db.close()
+
+def main():
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    per_writer = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    total = writers * per_writer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bmi_app.DATABASE = os.path.join(tmp, 'bench.db')
+        bmi_app.init_db()
+
+        elapsed, errors = run_writers(writers, per_writer, direct_save)
+        print(f"per-request commit : {total / elapsed:8.0f} rows/s  ({elapsed:.2f}s, {len(errors)} errors)")
+
+        for sync in ('FULL', 'NORMAL'):
+            writer = GroupCommitWriter(bmi_app.DATABASE, max_batch=64, max_delay_ms=5, synchronous=sync)
+            save = lambda values: writer.run(lambda db: bmi_app.insert_bmi_record(db, values))
+            elapsed, errors = run_writers(writers, per_writer, save)
+            print(f"group commit {sync:<6}: {total / elapsed:8.0f} rows/s  ({elapsed:.2f}s, {len(errors)} errors, "
+                  f"{writer.jobs / max(writer.batches, 1):.1f} rows/commit)")
+
+if __name__ == '__main__':
+    main()
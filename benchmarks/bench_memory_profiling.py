@@ -0,0 +1,47 @@
+# Cost of MEMORY_PROFILING on the invoice PDF render: wall time per render with tracemalloc
+# off and on, the traced peak per render, and RSS after a batch of renders.
+# Usage: python benchmarks/bench_memory_profiling.py [renders]
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def render_batch(bmi_app, count):
+    record = {'height': 175, 'weight': 70, 'bmi': 22.86, 'category': 'Normal', 'age': 30, 'gender': 'Male'}
+    timings = []
+    for i in range(count):
+        start = time.perf_counter()
+        path = bmi_app.render_new_invoice('Bench Patient', 1, record, f'INV-BENCH-{i}', '2024-01-01 10:00:00')
+        timings.append(time.perf_counter() - start)
+        os.remove(path)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+def main():
+    import app as bmi_app
+    import memprofile
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bmi_app.TEMP_PDF_DIR = tmp
+        render_batch(bmi_app, 3)
+
+        off = render_batch(bmi_app, count)
+        print(f"tracing off     : p50 {off * 1000:6.1f} ms/render, rss {memprofile.current_rss_bytes() / 1048576:.1f} MiB")
+
+        for frames in (1, 10):
+            tracemalloc.start(frames)
+            bmi_app.memory_profiler.render_stats.clear()
+            on = render_batch(bmi_app, count)
+            stats = bmi_app.memory_profiler.render_stats['invoice_pdf']
+            print(f"tracing {frames:>2} frame: p50 {on * 1000:6.1f} ms/render ({on / off - 1:+.0%}), "
+                  f"peak {stats['peak_bytes_max'] / 1024:.0f} KiB/render, "
+                  f"traced {tracemalloc.get_traced_memory()[0] / 1024:.0f} KiB after {count} renders")
+            tracemalloc.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# Insert latency of a writer while an online backup runs: one backup step copying the whole
+# file (pages=-1), small page steps with a pause between them (restarting with backoff while the
+# writer keeps writing, until the timeout), and the same database in WAL mode.
+# Usage: python benchmarks/bench_online_backup.py [rows] [pages_per_step] [write_interval_ms] [timeout_s]
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backup
+
+def build_database(path, rows):
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE bmi_records (id INTEGER PRIMARY KEY, patient_id INTEGER, bmi REAL, notes TEXT)')
+    db.executemany('INSERT INTO bmi_records (patient_id, bmi, notes) VALUES (?, ?, ?)',
+                   ((i % 500, 18 + i % 20, 'x' * 200) for i in range(rows)))
+    db.commit()
+    db.close()
+
+def measure(path, dest, pages, sleep, interval, timeout):
+    latencies = []
+    done = threading.Event()
+
+    def writer():
+        db = sqlite3.connect(path, timeout=30)
+        while not done.is_set():
+            start = time.perf_counter()
+            db.execute('INSERT INTO bmi_records (patient_id, bmi, notes) VALUES (1, 22.5, ?)', ('bench',))
+            db.commit()
+            latencies.append(time.perf_counter() - start)
+            time.sleep(interval)
+        db.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    start = time.perf_counter()
+    try:
+        backup.backup_database(path, dest, pages=pages, sleep=sleep, timeout=timeout)
+        outcome = 'done'
+    except backup.BackupTimeout:
+        outcome = 'gave up'
+    elapsed = time.perf_counter() - start
+    done.set()
+    thread.join()
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[int(len(latencies) * 0.99)]
+    return outcome, elapsed, len(latencies), p50, p99, latencies[-1]
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    interval = (float(sys.argv[3]) if len(sys.argv) > 3 else 20) / 1000
+    timeout = float(sys.argv[4]) if len(sys.argv) > 4 else 10
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        build_database(path, rows)
+        print(f"database: {os.path.getsize(path) / 1e6:.1f} MB")
+        for label, step_pages, sleep in (('single step', -1, 0), (f'{pages} pages/step', pages, 0.005),
+                                         ('wal', pages, 0.005)):
+            if label == 'wal':
+                db = sqlite3.connect(path)
+                db.execute('PRAGMA journal_mode=WAL')
+                db.close()
+            outcome, elapsed, writes, p50, p99, worst = measure(path, os.path.join(tmp, 'copy.db'), step_pages,
+                                                                sleep, interval, timeout)
+            print(f"{label:<16}: backup {outcome:<7} {elapsed:5.2f}s, {writes:5d} writes, insert p50 {p50 * 1000:6.2f} ms, "
+                  f"p99 {p99 * 1000:7.2f} ms, max {worst * 1000:7.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# Login throughput with inline hashing vs the hashing process pool, plus the latency of a
+# cheap route (GET /login) served while the login storm is running.
+# Usage: python benchmarks/bench_password_hashing.py [concurrent_logins] [logins_per_client]
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def run_storm(bmi_app, clients, per_client):
+    barrier = threading.Barrier(clients + 1)
+    done = threading.Event()
+    cheap_latencies = []
+
+    def login_worker():
+        client = bmi_app.app.test_client()
+        barrier.wait()
+        for _ in range(per_client):
+            client.post('/login', json={'email': 'bench@example.com', 'password': 'bench-password'})
+
+    def cheap_worker():
+        client = bmi_app.app.test_client()
+        barrier.wait()
+        while not done.is_set():
+            start = time.perf_counter()
+            client.get('/login')
+            cheap_latencies.append(time.perf_counter() - start)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=login_worker) for _ in range(clients)]
+    probe = threading.Thread(target=cheap_worker)
+    for thread in threads + [probe]:
+        thread.start()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    probe.join()
+    cheap_latencies.sort()
+    p95 = cheap_latencies[int(len(cheap_latencies) * 0.95)] if cheap_latencies else 0
+    return clients * per_client / elapsed, p95
+
+def main():
+    import app as bmi_app
+    import passwords
+
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    per_client = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    pool_workers = passwords.PASSWORD_HASH_WORKERS or 2
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bmi_app.DATABASE = os.path.join(tmp, 'bench.db')
+        bmi_app.init_db()
+        bmi_app.app.test_client().post('/register', json={
+            'name': 'Bench', 'email': 'bench@example.com',
+            'password': 'bench-password', 'confirm_password': 'bench-password'
+        })
+
+        for label, workers in (('inline', 0), (f'pool x{pool_workers}', pool_workers)):
+            passwords.PASSWORD_HASH_WORKERS = workers
+            rate, p95 = run_storm(bmi_app, clients, per_client)
+            print(f"{label:<10}: {rate:6.1f} logins/s, GET /login p95 {p95 * 1000:7.1f} ms "
+                  f"(method {passwords.PASSWORD_HASH_METHOD}, cap {passwords.PASSWORD_HASH_CONCURRENCY})")
+
+if __name__ == '__main__':
+    main()
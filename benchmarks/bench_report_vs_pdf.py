@@ -0,0 +1,55 @@
+# Latency and response size of the HTML print view (/report/<id>) vs rendering the invoice PDF
+# (/download-invoice/<id> with no cached file on disk).
+# Usage: python benchmarks/bench_report_vs_pdf.py [invoices]
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def timed(client, url):
+    start = time.perf_counter()
+    response = client.get(url)
+    return time.perf_counter() - start, len(response.get_data())
+
+def summarise(label, samples):
+    latencies = sorted(latency for latency, _ in samples)
+    size = sum(size for _, size in samples) / len(samples)
+    print(f"{label:<24}: p50 {latencies[len(latencies) // 2] * 1000:7.2f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:7.2f} ms, {size / 1024:6.1f} KiB")
+
+def main():
+    import app as bmi_app
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bmi_app.DATABASE = os.path.join(tmp, 'bench.db')
+        bmi_app.TEMP_PDF_DIR = tmp
+        bmi_app.init_db()
+        bmi_app.rate_limiter.limits['pdf'] = {}
+        client = bmi_app.app.test_client()
+        client.post('/register', json={'name': 'Bench', 'email': 'bench@example.com',
+                                       'password': 'bench-password', 'confirm_password': 'bench-password'})
+        client.post('/login', json={'email': 'bench@example.com', 'password': 'bench-password'})
+
+        invoice_ids = []
+        for i in range(count):
+            record_id = client.post('/bmi', json={'age': 20 + i % 50, 'gender': 'Male', 'height': 175, 'weight': 55 + i}).get_json()['record_id']
+            invoice_ids.append(client.post(f'/create-invoice/{record_id}').get_json()['invoice_id'])
+
+        bmi_app.report_fragments.clear()
+        summarise('html, cold fragments', [timed(client, f'/report/{invoice_id}') for invoice_id in invoice_ids])
+        summarise('html, warm fragments', [timed(client, f'/report/{invoice_id}') for invoice_id in invoice_ids])
+
+        pdf_samples = []
+        for invoice_id in invoice_ids:
+            for name in os.listdir(tmp):
+                if name.startswith('Invoice_'):
+                    os.remove(os.path.join(tmp, name))
+            pdf_samples.append(timed(client, f'/download-invoice/{invoice_id}'))
+        summarise('pdf render', pdf_samples)
+
+if __name__ == '__main__':
+    main()
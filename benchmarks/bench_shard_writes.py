@@ -0,0 +1,49 @@
+# Concurrent /bmi insert throughput through save_bmi_record() with 1, 2 and 4 shard files.
+# Every writer thread owns a few patients, so with more shards fewer writers share a file lock.
+# Usage: python benchmarks/bench_shard_writes.py [writers] [inserts_per_writer]
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def run(bmi_app, writers, per_writer):
+    barrier = threading.Barrier(writers + 1)
+    errors = []
+
+    def writer(worker):
+        barrier.wait()
+        for i in range(per_writer):
+            patient_id = worker * 1000 + i % 8
+            try:
+                bmi_app.save_bmi_record((patient_id, 30, 'Male', 170.0, 65.0, 22.49, 'Normal weight', bmi_app.now_ms()))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(worker,)) for worker in range(writers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return writers * per_writer / (time.perf_counter() - start), len(errors)
+
+def main():
+    import app as bmi_app
+
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    per_writer = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    for count in (1, 2, 4):
+        with tempfile.TemporaryDirectory() as tmp:
+            bmi_app.DATABASE = os.path.join(tmp, 'bench.db')
+            bmi_app.DB_SHARDS = count
+            bmi_app.init_db()
+            rate, errors = run(bmi_app, writers, per_writer)
+            print(f"{count} shard(s): {rate:8.1f} inserts/s with {writers} writers ({errors} errors)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# Latency of creating and downloading an invoice with and without speculative pre-rendering.
+# Each iteration creates the invoice, waits think_ms (the user looking at the confirmation
+# before clicking download), then downloads its PDF. With speculation the render started by
+# /create-invoice runs during that wait; the reported time excludes the wait itself.
+# Usage: python benchmarks/bench_speculative_invoice.py [iterations] [think_ms]
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def run(client, iterations, think):
+    latencies = []
+    for i in range(iterations):
+        record_id = client.post('/bmi', json={'age': 35, 'gender': 'Female', 'height': 165, 'weight': 60 + i % 20}).get_json()['record_id']
+        start = time.perf_counter()
+        invoice_id = client.post(f'/create-invoice/{record_id}').get_json()['invoice_id']
+        created = time.perf_counter()
+        time.sleep(think)
+        resumed = time.perf_counter()
+        assert client.get(f'/download-invoice/{invoice_id}').status_code == 200
+        latencies.append(created - start + time.perf_counter() - resumed)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+
+def main():
+    import app as bmi_app
+    import metrics
+
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    think = (float(sys.argv[2]) if len(sys.argv) > 2 else 300) / 1000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bmi_app.DATABASE = os.path.join(tmp, 'bench.db')
+        bmi_app.TEMP_PDF_DIR = tmp
+        bmi_app.init_db()
+        # The benchmark downloads invoices faster than the default per-user limit allows
+        bmi_app.rate_limiter.limits['pdf'] = {}
+        client = bmi_app.app.test_client()
+        client.post('/register', json={'name': 'Bench', 'email': 'bench@example.com',
+                                       'password': 'bench-password', 'confirm_password': 'bench-password'})
+        client.post('/login', json={'email': 'bench@example.com', 'password': 'bench-password'})
+
+        for label, enabled in (('synchronous', False), ('speculative', True)):
+            bmi_app.SPECULATIVE_INVOICES = enabled
+            p50, p95 = run(client, iterations, think)
+            print(f"{label:<12}: create + download p50 {p50 * 1000:6.1f} ms, p95 {p95 * 1000:6.1f} ms")
+
+        outcomes = {labels['outcome']: value for name, labels, value in metrics.samples()
+                    if name == 'speculative_renders_total'}
+        print(f"speculation outcomes: {outcomes}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Checks /download-invoice under each PDF_DELIVERY backend without nginx or apache: the
+# X-Accel-Redirect / X-Sendfile headers point at the cached file and carry no body, and the
+# 'flask' fallback hands the open file to wsgi.file_wrapper (os.sendfile under gunicorn) and
+# returns the whole PDF. Exits non-zero on the first failed check.
+# Usage: python benchmarks/check_pdf_delivery.py
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+
+class RecordingFileWrapper:
+    # Stands in for the server's wsgi.file_wrapper and remembers which file it was given
+    wrapped = []
+
+    def __init__(self, filelike, block_size=8192):
+        self.filelike = filelike
+        self.block_size = block_size
+        RecordingFileWrapper.wrapped.append(getattr(filelike, 'name', None))
+
+    def __iter__(self):
+        while True:
+            data = self.filelike.read(self.block_size)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self.filelike.close()
+
+def download(bmi_app, client, mode, invoice_id, headers=None):
+    bmi_app.PDF_DELIVERY = mode
+    bmi_app.app.config['USE_X_SENDFILE'] = mode == 'apache'
+    RecordingFileWrapper.wrapped.clear()
+    return client.get(f'/download-invoice/{invoice_id}', headers=headers,
+                      environ_overrides={'wsgi.file_wrapper': RecordingFileWrapper})
+
+def main():
+    import app as bmi_app
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bmi_app.DATABASE = os.path.join(tmp, 'check.db')
+        bmi_app.TEMP_PDF_DIR = tmp
+        bmi_app.init_db()
+        client = bmi_app.app.test_client()
+        client.post('/register', json={'name': 'Check Patient', 'email': 'check@example.com',
+                                       'password': 'secret1', 'confirm_password': 'secret1'})
+        client.post('/login', json={'email': 'check@example.com', 'password': 'secret1'})
+        client.post('/bmi', json={'age': 30, 'gender': 'Female', 'height': 165, 'weight': 60})
+        invoice = client.post('/create-invoice/1').get_json()
+        invoice_id = invoice['invoice_id']
+        disposition = f"attachment; filename=Prescription_{invoice['invoice_number']}.pdf"
+
+        response = download(bmi_app, client, 'flask', invoice_id)
+        pdf_files = [name for name in os.listdir(tmp) if name.startswith('Invoice_')]
+        assert response.status_code == 200, response.status_code
+        assert len(pdf_files) == 1, pdf_files
+        pdf_path = os.path.join(tmp, pdf_files[0])
+        with open(pdf_path, 'rb') as f:
+            assert response.data == f.read(), 'flask: body differs from the cached PDF'
+        assert response.data.startswith(b'%PDF-') and response.data.rstrip().endswith(b'%%EOF')
+        assert response.content_length == os.path.getsize(pdf_path)
+        assert RecordingFileWrapper.wrapped == [pdf_path], RecordingFileWrapper.wrapped
+        assert 'X-Accel-Redirect' not in response.headers and 'X-Sendfile' not in response.headers
+        assert response.headers['Content-Disposition'] == disposition
+        print(f"flask : 200, {len(response.data)} bytes via wsgi.file_wrapper({os.path.basename(pdf_path)})")
+
+        response = download(bmi_app, client, 'nginx', invoice_id)
+        expected = bmi_app.NGINX_PDF_PREFIX + os.path.basename(pdf_path)
+        assert response.status_code == 200, response.status_code
+        assert response.headers.get('X-Accel-Redirect') == expected, response.headers.get('X-Accel-Redirect')
+        assert response.data == b'', 'nginx: the body must come from nginx'
+        assert response.headers['Content-Type'] == 'application/pdf'
+        assert response.headers['Content-Disposition'] == disposition
+        assert 'X-Sendfile' not in response.headers
+        print(f"nginx : 200, X-Accel-Redirect: {expected}, empty body")
+
+        response = download(bmi_app, client, 'apache', invoice_id)
+        assert response.status_code == 200, response.status_code
+        assert response.headers.get('X-Sendfile') == pdf_path, response.headers.get('X-Sendfile')
+        assert response.data == b'', 'apache: the body must come from mod_xsendfile'
+        assert response.headers['Content-Disposition'] == disposition
+        assert 'X-Accel-Redirect' not in response.headers
+        print(f"apache: 200, X-Sendfile: {pdf_path}, empty body")
+
+        for mode in ('flask', 'nginx', 'apache'):
+            revalidated = download(bmi_app, client, mode, invoice_id, {'If-None-Match': response.headers['ETag']})
+            assert revalidated.status_code == 304, (mode, revalidated.status_code)
+        print("all   : If-None-Match revalidation answers 304")
+
+if __name__ == '__main__':
+    main()
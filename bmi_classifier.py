@@ -0,0 +1,109 @@
+import bisect
+from array import array
+from functools import lru_cache
+
+# Ages 20 and over use the fixed WHO adult cutoffs, younger patients are classified
+# against sex-specific BMI-for-age percentiles
+ADULT_AGE = 20
+
+CATEGORY_ORDER = ('Underweight', 'Normal', 'Overweight', 'Obese')
+ADULT_CUTOFFS = (18.5, 25.0, 30.0)
+
+# (low, high) range per adult category, derived from ADULT_CUTOFFS so the cutoffs live in one place
+_ADULT_BOUNDS = (0,) + ADULT_CUTOFFS + (float('inf'),)
+BMI_CATEGORIES = dict(zip(CATEGORY_ORDER, zip(_ADULT_BOUNDS, _ADULT_BOUNDS[1:])))
+
+# Single source for the text and colours shown on the result page and in both PDFs
+CATEGORY_INFO = {
+    'Underweight': {
+        'advice': 'Consider consulting a healthcare professional. A balanced diet with adequate calories and nutrients is important.',
+        'risk_level': 'High Risk',
+        'classification': 'Nutritional Deficit',
+        'color': '#2563EB'
+    },
+    'Normal': {
+        'advice': 'Great! Maintain your healthy weight with regular exercise and a balanced diet.',
+        'risk_level': 'Low Risk',
+        'classification': 'Optimal Health Range',
+        'color': '#059669'
+    },
+    'Overweight': {
+        'advice': 'Consider a healthier lifestyle with regular physical activity and a balanced diet. Consult a healthcare provider if needed.',
+        'risk_level': 'Moderate Risk',
+        'classification': 'Increased Health Risk',
+        'color': '#D97706'
+    },
+    'Obese': {
+        'advice': 'It is highly recommended to consult a healthcare professional for personalized advice on weight management.',
+        'risk_level': 'High Risk',
+        'classification': 'Significant Health Risk',
+        'color': '#DC2626'
+    }
+}
+
+HEALTH_ADVICE = {category: info['advice'] for category, info in CATEGORY_INFO.items()}
+
+# CDC 2000 BMI-for-age growth charts, 5th / 85th / 95th percentiles at whole years 2-19 (rounded)
+_PEDIATRIC_REFERENCE = {
+    'Male': (
+        (2, 14.8, 18.2, 19.3), (3, 14.4, 17.3, 18.2), (4, 14.0, 16.9, 17.8), (5, 13.8, 16.8, 18.0),
+        (6, 13.7, 17.0, 18.4), (7, 13.7, 17.4, 19.1), (8, 13.8, 17.9, 20.0), (9, 14.0, 18.6, 21.0),
+        (10, 14.2, 19.4, 22.0), (11, 14.5, 20.2, 23.0), (12, 14.9, 21.0, 24.0), (13, 15.4, 21.8, 24.8),
+        (14, 15.9, 22.6, 25.7), (15, 16.5, 23.4, 26.5), (16, 17.0, 24.2, 27.3), (17, 17.6, 24.9, 28.1),
+        (18, 18.1, 25.6, 28.9), (19, 18.6, 26.3, 29.7)
+    ),
+    'Female': (
+        (2, 14.4, 18.0, 19.1), (3, 14.0, 17.2, 18.3), (4, 13.7, 16.8, 18.0), (5, 13.5, 16.8, 18.3),
+        (6, 13.4, 17.1, 19.2), (7, 13.4, 17.6, 20.1), (8, 13.5, 18.3, 21.1), (9, 13.7, 19.1, 22.1),
+        (10, 14.0, 19.9, 23.0), (11, 14.4, 20.8, 24.1), (12, 14.8, 21.7, 25.2), (13, 15.3, 22.5, 26.2),
+        (14, 15.8, 23.3, 27.2), (15, 16.3, 24.0, 28.1), (16, 16.8, 24.7, 28.9), (17, 17.2, 25.2, 29.6),
+        (18, 17.5, 25.7, 30.3), (19, 17.8, 26.1, 31.0)
+    )
+}
+
+def _build_tables():
+    # One compact array per percentile column, all sharing the same age axis
+    ages = array('d', (row[0] for row in _PEDIATRIC_REFERENCE['Male']))
+    tables = {}
+    for sex, rows in _PEDIATRIC_REFERENCE.items():
+        tables[sex] = tuple(array('d', (row[column] for row in rows)) for column in (1, 2, 3))
+    # Unspecified gender falls back to the midpoint of both charts
+    tables[None] = tuple(
+        array('d', ((m + f) / 2 for m, f in zip(male, female)))
+        for male, female in zip(tables['Male'], tables['Female'])
+    )
+    return ages, tables
+
+_AGES, _TABLES = _build_tables()
+
+def normalize_gender(gender):
+    value = str(gender or '').strip().lower()
+    if value.startswith('m'):
+        return 'Male'
+    if value.startswith('f'):
+        return 'Female'
+    return None
+
+@lru_cache(maxsize=512)
+def _pediatric_cutoffs(age, sex):
+    age = min(max(age, _AGES[0]), _AGES[-1])
+    index = min(bisect.bisect_right(_AGES, age), len(_AGES) - 1)
+    low, high = index - 1, index
+    if low < 0 or _AGES[high] == age:
+        return tuple(column[high] for column in _TABLES[sex])
+    weight = (age - _AGES[low]) / (_AGES[high] - _AGES[low])
+    return tuple(column[low] + (column[high] - column[low]) * weight for column in _TABLES[sex])
+
+def get_cutoffs(age=None, gender=None):
+    if age is None or age >= ADULT_AGE:
+        return ADULT_CUTOFFS
+    return _pediatric_cutoffs(float(age), normalize_gender(gender))
+
+def classify(bmi, age=None, gender=None):
+    return CATEGORY_ORDER[bisect.bisect_right(get_cutoffs(age, gender), bmi)]
+
+def reference_name(age=None):
+    return 'WHO Standards' if age is None or age >= ADULT_AGE else 'CDC BMI-for-age'
+
+def get_category_info(category):
+    return CATEGORY_INFO.get(category, {})
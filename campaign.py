@@ -0,0 +1,256 @@
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import ratelimit
+
+def init_campaign_tables(db):
+    # Progress of `flask send-campaign` runs, kept on the primary next to users
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS mail_campaigns (
+            name TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            due_before_ms INTEGER NOT NULL,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            started_ms INTEGER NOT NULL,
+            updated_ms INTEGER NOT NULL,
+            finished_ms INTEGER
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS mail_campaign_deliveries (
+            campaign TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            detail TEXT,
+            sent_ms INTEGER NOT NULL,
+            PRIMARY KEY (campaign, user_id)
+        )
+    ''')
+
+class Checkpoint:
+    # The campaign's cursor (last user id whose whole chunk was handled) plus one row per
+    # recipient, so a resumed run skips people who already got the message mid-chunk and
+    # retries the ones whose send failed.
+    # A dry run reads existing progress but never writes any.
+    def __init__(self, db, name, kind, due_before_ms, now_ms, dry_run=False):
+        self.db = db
+        self.name = name
+        self.dry_run = dry_run
+        self.now_ms = now_ms
+        row = db.execute('SELECT * FROM mail_campaigns WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            self.kind, self.due_before_ms, self.last_user_id = kind, due_before_ms, 0
+            if not dry_run:
+                db.execute('INSERT INTO mail_campaigns (name, kind, due_before_ms, started_ms, updated_ms) VALUES (?, ?, ?, ?, ?)',
+                           (name, kind, due_before_ms, now_ms(), now_ms()))
+                db.commit()
+        elif row['kind'] != kind:
+            raise ValueError(f"campaign '{name}' already exists as a '{row['kind']}' campaign")
+        else:
+            # Resuming keeps the original cut-off so the recipient list does not shift underneath it
+            self.kind, self.due_before_ms, self.last_user_id = row['kind'], row['due_before_ms'], row['last_user_id']
+        self.resumed = row is not None
+
+    def delivered(self, user_ids):
+        placeholders = ','.join('?' * len(user_ids))
+        rows = self.db.execute(f"SELECT user_id FROM mail_campaign_deliveries WHERE campaign = ? AND status = 'sent' "
+                               f"AND user_id IN ({placeholders})", (self.name, *user_ids)).fetchall()
+        return {row['user_id'] for row in rows}
+
+    def failed(self):
+        # Recipients behind the cursor whose last attempt failed; they are retried on resume
+        rows = self.db.execute("SELECT user_id FROM mail_campaign_deliveries WHERE campaign = ? AND status = 'failed' "
+                               "AND user_id <= ? ORDER BY user_id", (self.name, self.last_user_id)).fetchall()
+        return [row['user_id'] for row in rows]
+
+    def record(self, user_id, status, detail=None):
+        if self.dry_run:
+            return
+        self.db.execute('INSERT OR REPLACE INTO mail_campaign_deliveries (campaign, user_id, status, detail, sent_ms) '
+                        'VALUES (?, ?, ?, ?, ?)', (self.name, user_id, status, detail, self.now_ms()))
+        self.db.commit()
+
+    def advance(self, last_user_id):
+        # Retried chunks sit behind the cursor and never move it back
+        if last_user_id <= self.last_user_id:
+            return
+        self.last_user_id = last_user_id
+        if self.dry_run:
+            return
+        self.db.execute('UPDATE mail_campaigns SET last_user_id = ?, updated_ms = ? WHERE name = ?',
+                        (last_user_id, self.now_ms(), self.name))
+        self.db.commit()
+
+    def finish(self):
+        if self.dry_run:
+            return
+        self.db.execute('UPDATE mail_campaigns SET finished_ms = ?, updated_ms = ? WHERE name = ?',
+                        (self.now_ms(), self.now_ms(), self.name))
+        self.db.commit()
+
+def iter_user_chunks(db, after_id, chunk_size):
+    # Keyset pagination over users: memory stays flat however many patients there are,
+    # and a resumed campaign starts right after its checkpoint
+    while True:
+        rows = db.execute('SELECT id, name, email FROM users WHERE id > ? ORDER BY id LIMIT ?',
+                          (after_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1]['id']
+
+def iter_users_by_id(db, user_ids, chunk_size):
+    # The same user rows as iter_user_chunks, for an explicit list of ids (e.g. retries)
+    for start in range(0, len(user_ids), chunk_size):
+        batch = user_ids[start:start + chunk_size]
+        rows = db.execute(f"SELECT id, name, email FROM users WHERE id IN ({','.join('?' * len(batch))}) ORDER BY id",
+                          batch).fetchall()
+        if rows:
+            yield rows
+
+def latest_readings(db, patient_ids, schema='main'):
+    # {patient_id: most recent bmi_records row}, answered from idx_bmi_records_patient_date;
+    # schema='archive' reads an attached archive instead
+    if not patient_ids:
+        return {}
+    placeholders = ','.join('?' * len(patient_ids))
+    rows = db.execute(f'''
+        SELECT b.* FROM {schema}.bmi_records b
+        JOIN (SELECT patient_id, MAX(date_ms) AS last_ms FROM {schema}.bmi_records
+              WHERE patient_id IN ({placeholders}) GROUP BY patient_id) latest
+          ON b.patient_id = latest.patient_id AND b.date_ms = latest.last_ms
+        ORDER BY b.id
+    ''', tuple(patient_ids)).fetchall()
+    return {row['patient_id']: row for row in rows}
+
+class SMTPPool:
+    # A few long-lived SMTP sessions shared by the sender threads instead of one
+    # connect + login per message. A session is closed and reopened after max_messages,
+    # since providers cap how much one session may send.
+    def __init__(self, connect, size=2, max_messages=100):
+        self.connect = connect
+        self.size = size
+        self.max_messages = max_messages
+        self.opened = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def send(self, message):
+        with self._slots:
+            try:
+                server, count = self._idle.get_nowait()
+            except queue.Empty:
+                server, count = self._open(), 0
+            try:
+                try:
+                    server.send_message(message)
+                except smtplib.SMTPServerDisconnected:
+                    # Servers drop sessions that sat idle; retry once on a fresh one
+                    self._close(server)
+                    server, count = self._open(), 0
+                    server.send_message(message)
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException):
+                # The server refused this message but the session itself is still usable
+                self._release(server, count)
+                raise
+            except Exception:
+                self._close(server)
+                raise
+            self._release(server, count + 1)
+
+    def warm(self):
+        # Opens one session up front so a wrong host or bad credentials fail before anyone is mailed
+        self._idle.put((self._open(), 0))
+
+    def close(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(server)
+
+    def _open(self):
+        self.opened += 1
+        metrics.inc('smtp_connections_opened_total')
+        return self.connect()
+
+    def _release(self, server, count):
+        if count >= self.max_messages:
+            self._close(server)
+        else:
+            self._idle.put((server, count))
+
+    def _close(self, server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+class Throttle:
+    # Paces sends with a token bucket; rate is (burst, per_second) as from ratelimit.parse_rate
+    def __init__(self, rate):
+        self.rate = rate
+        self.store = ratelimit.MemoryBucketStore()
+
+    def wait(self):
+        if self.rate is None:
+            return
+        while True:
+            key, retry_after = self.store.take([('campaign',) + self.rate])
+            if key is None:
+                return
+            time.sleep(retry_after)
+
+def run_campaign(checkpoint, chunks, select_due, render, pool, throttle, render_workers=4, log=print):
+    # chunks yields lists of user rows; select_due(users) returns the (user, reading) pairs to mail;
+    # render(user, reading) builds the message. Attachments for a chunk render in parallel while
+    # earlier messages are already going out over the pool (pool=None is a dry run).
+    totals = {'sent': 0, 'failed': 0, 'skipped': 0}
+    senders = ThreadPoolExecutor(max_workers=pool.size if pool else 1, thread_name_prefix='campaign-send')
+    renderers = ThreadPoolExecutor(max_workers=max(render_workers, 1), thread_name_prefix='campaign-render')
+    try:
+        for users in chunks:
+            done = checkpoint.delivered([user['id'] for user in users])
+            due = [(user, reading) for user, reading in select_due(users) if user['id'] not in done]
+            totals['skipped'] += len(users) - len(due)
+            pending = []
+            for (user, reading), future in [(pair, renderers.submit(render, *pair)) for pair in due]:
+                try:
+                    message = future.result()
+                except Exception as e:
+                    print(f"DEBUG: Campaign render failed for user {user['id']}: {e}")
+                    checkpoint.record(user['id'], 'failed', f'render: {e}')
+                    totals['failed'] += 1
+                    continue
+                if pool is None:
+                    totals['sent'] += 1
+                    continue
+                throttle.wait()
+                pending.append((user, senders.submit(pool.send, message)))
+            for user, future in pending:
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"DEBUG: Campaign send failed for user {user['id']}: {e}")
+                    checkpoint.record(user['id'], 'failed', str(e))
+                    totals['failed'] += 1
+                    metrics.inc('campaign_messages_total', outcome='failed')
+                else:
+                    checkpoint.record(user['id'], 'sent')
+                    totals['sent'] += 1
+                    metrics.inc('campaign_messages_total', outcome='sent')
+            checkpoint.advance(users[-1]['id'])
+            log(f"{checkpoint.name}: through user {users[-1]['id']} - "
+                f"{'would send' if pool is None else 'sent'} {totals['sent']}, failed {totals['failed']}, skipped {totals['skipped']}")
+        checkpoint.finish()
+    finally:
+        renderers.shutdown(wait=True)
+        senders.shutdown(wait=True)
+        if pool is not None:
+            pool.close()
+    return totals
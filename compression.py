@@ -0,0 +1,85 @@
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; clients asking for br get gzip instead
+    brotli = None
+
+import metrics
+
+# Only text-like bodies shrink enough to be worth the CPU; PDFs are already deflated
+COMPRESSIBLE_TYPES = ('text/html', 'text/css', 'text/plain', 'text/csv', 'application/json',
+                      'application/javascript', 'text/javascript', 'image/svg+xml')
+
+def choose_encoding(accept_encodings):
+    # Brotli wins when both are acceptable; ties between the client's q-values are not worth honouring
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def compress_body(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def compress_stream(chunks, encoding, level):
+    # Incremental encoder for streamed responses: every chunk is flushed so the client sees
+    # it as soon as the route yields it, instead of waiting for the compressor's buffer to fill
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+        compress, finish = compressor.compress, compressor.flush
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compress(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def compress_response(response, accept_encodings, min_size, gzip_level, brotli_level):
+    # Compresses a finished Flask response in place when the client and the body allow it
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES
+            or 'no-transform' in response.headers.get('Cache-Control', '')):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return response
+    level = brotli_level if encoding == 'br' else gzip_level
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding, level)
+        response.headers.pop('Content-Length', None)
+        metrics.inc('http_compressed_responses_total', encoding=encoding, mode='stream')
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        compressed = compress_body(data, encoding, level)
+        if len(compressed) >= len(data):
+            return response
+        response.set_data(compressed)
+        metrics.inc('http_compressed_responses_total', encoding=encoding, mode='buffered')
+        metrics.inc('http_compression_bytes_total', len(data), encoding=encoding, stage='in')
+        metrics.inc('http_compression_bytes_total', len(compressed), encoding=encoding, stage='out')
+
+    response.headers['Content-Encoding'] = encoding
+    # The bytes differ from the uncompressed representation, so only a weak validator still holds
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,125 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+import metrics
+
+class MemoryFragmentStore:
+    # Bounded LRU in this process; every worker keeps its own copy
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        # Returns how many entries were evicted to make room
+        evicted = 0
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def count(self, prefix=''):
+        with self._lock:
+            return sum(1 for key in self._entries if key.startswith(prefix))
+
+    def clear(self, prefix=''):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+class SQLiteFragmentStore:
+    # Fragments shared by every worker through one SQLite file, so a page rendered by one worker
+    # is a hit on all of them. Recency is only written when an entry was last touched more than
+    # touch_interval seconds ago, which keeps hits read-only; eviction is approximate LRU and runs
+    # every prune_every writes.
+    def __init__(self, path, max_entries=5000, touch_interval=60, prune_every=64):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.prune_every = prune_every
+        self._local = threading.local()
+        self._puts = 0
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS fragments (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    accessed REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            db.execute('CREATE INDEX IF NOT EXISTS idx_fragments_accessed ON fragments (accessed)')
+            self._local.db = db
+        return db
+
+    def get(self, key):
+        db = self._connect()
+        row = db.execute('SELECT value, accessed FROM fragments WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > self.touch_interval:
+            db.execute('UPDATE fragments SET accessed = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def put(self, key, value):
+        db = self._connect()
+        db.execute('INSERT OR REPLACE INTO fragments (key, value, accessed) VALUES (?, ?, ?)', (key, str(value), time.time()))
+        self._puts += 1
+        if self._puts % self.prune_every:
+            return 0
+        cursor = db.execute('DELETE FROM fragments WHERE key IN (SELECT key FROM fragments ORDER BY accessed '
+                            'LIMIT max(0, (SELECT COUNT(*) FROM fragments) - ?))', (self.max_entries,))
+        return cursor.rowcount
+
+    def count(self, prefix=''):
+        return self._connect().execute('SELECT COUNT(*) FROM fragments WHERE substr(key, 1, ?) = ?',
+                                       (len(prefix), prefix)).fetchone()[0]
+
+    def clear(self, prefix=''):
+        self._connect().execute('DELETE FROM fragments WHERE substr(key, 1, ?) = ?', (len(prefix), prefix))
+
+class FragmentCache:
+    # Rendered template fragments (Markup strings) in a MemoryFragmentStore or SQLiteFragmentStore.
+    # Keys must capture everything the fragment depends on, including a version when the data
+    # behind it can change; hits, misses and evictions are exported per cache name.
+    def __init__(self, name, max_entries=512, store=None):
+        self.name = name
+        self.store = store if store is not None else MemoryFragmentStore(max_entries)
+
+    def get_or_render(self, key, render):
+        store_key = f'{self.name}:{key!r}'
+        fragment = self.store.get(store_key)
+        if fragment is not None:
+            metrics.inc('fragment_cache_total', cache=self.name, outcome='hit')
+            return Markup(fragment)
+        metrics.inc('fragment_cache_total', cache=self.name, outcome='miss')
+        fragment = render()
+        evicted = self.store.put(store_key, fragment)
+        if evicted:
+            metrics.inc('fragment_cache_evictions_total', evicted, cache=self.name)
+        return fragment
+
+    def collect_metrics(self):
+        yield 'fragment_cache_entries', {'cache': self.name}, self.store.count(f'{self.name}:')
+
+    def clear(self):
+        self.store.clear(f'{self.name}:')
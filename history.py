@@ -0,0 +1,127 @@
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+
+import archive
+
+# Metric name in the URL -> bmi_records column
+METRICS = {'bmi': 'bmi', 'weight': 'weight'}
+
+BINARY_MAGIC = b'BMIH'
+
+class SeriesCache:
+    # Small per-patient LRU of (timestamps, values) buffers. Entries remember the row count and
+    # latest timestamp they were built from, so a stale entry is detected even when another
+    # worker did the insert.
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, series):
+        with self._lock:
+            self._entries[key] = (version, series)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_patient(self, patient_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == patient_id]:
+                del self._entries[key]
+
+# Both queries read archived readings too when the caller has attached the archive
+def series_version(db, patient_id):
+    row = db.execute(
+        f"SELECT COUNT(*), MAX(date_ms) FROM {archive.with_archive(db, 'bmi_records', 'patient_id, date_ms')} "
+        'WHERE patient_id = ? AND date_ms IS NOT NULL',
+        (patient_id,)
+    ).fetchone()
+    return (row[0], row[1])
+
+def load_series(db, patient_id, metric):
+    timestamps = array('d')
+    values = array('d')
+    column = METRICS[metric]
+    cursor = db.execute(
+        f"SELECT date_ms, {column} FROM {archive.with_archive(db, 'bmi_records', f'patient_id, date_ms, {column}')} "
+        'WHERE patient_id = ? AND date_ms IS NOT NULL ORDER BY date_ms',
+        (patient_id,)
+    )
+    for epoch_ms, value in cursor:
+        timestamps.append(epoch_ms)
+        values.append(value)
+    return timestamps, values
+
+def get_series(db, cache, patient_id, metric):
+    key = (patient_id, metric)
+    version = series_version(db, patient_id)
+    series = cache.get(key, version)
+    if series is None:
+        series = load_series(db, patient_id, metric)
+        cache.put(key, version, series)
+    return series
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the first and last point and, for every bucket in
+    # between, the point forming the largest triangle with the previous pick and the next
+    # bucket's average. Returns the selected indices.
+    size = len(x)
+    if threshold >= size or threshold < 3:
+        return np.arange(size)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = size - 1
+    edges = np.linspace(1, size - 1, threshold - 1).astype(np.int64)
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = end, edges[i + 2]
+        else:
+            next_start, next_end = size - 1, size
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        areas = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        selected[i + 1] = previous
+    return selected
+
+def downsample(series, points):
+    x = np.frombuffer(series[0], dtype=np.float64)
+    y = np.frombuffer(series[1], dtype=np.float64)
+    indices = lttb(x, y, points)
+    return x[indices], y[indices]
+
+def to_json_payload(metric, total, x, y):
+    return {
+        'success': True,
+        'metric': metric,
+        'total': total,
+        'points': int(len(x)),
+        't': x.astype(np.int64).tolist(),
+        'v': np.round(y, 2).tolist()
+    }
+
+def to_binary_payload(x, y):
+    # Header: magic + little-endian uint32 count, then count float64 timestamps (ms) and count float64 values
+    return struct.pack('<4sI', BINARY_MAGIC, len(x)) + x.astype('<f8').tobytes() + y.astype('<f8').tobytes()
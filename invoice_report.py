@@ -0,0 +1,63 @@
+from bmi_classifier import get_category_info, reference_name
+
+# Section definitions shared by the invoice PDF (generate_invoice_pdf) and the HTML print
+# view (/report/<id>), so both always show the same content in the same order
+
+CLINIC = {
+    'name': 'LifeTrack Health Hub',
+    'subtitle': 'MEDICAL & WELLNESS REPORT',
+    'contact': ['support@lifetrack.com', '+91 98765 43210', 'www.lifetrack.com']
+}
+
+PRESCRIPTION_ITEMS = [
+    "Maintain a balanced nutritional intake focusing on whole grains, lean proteins, and micronutrients.",
+    "Ensure consistent physical activity (minimum 150 minutes of moderate aerobic exercise weekly).",
+    "Monitor hydration levels (2.5 - 3.0 Liters daily) and maintain a consistent sleep-wake cycle.",
+    "Limit intake of processed carbohydrates, saturated fats, and high-sodium dietary items.",
+    "Schedule a follow-up consultation with a clinical specialist for personalized metabolic evaluation."
+]
+
+DOCTORS = [
+    ('Dr. Sarah Thompson (MD)', 'Primary Consultant (Endocrinology)', 'Reg No: LT-DR-001'),
+    ('Dr. Rajesh Kumar (MS)', 'Clinical Nutritionist', 'Reg No: LT-DR-002'),
+    ('Dr. Anita Desai (MD)', 'General Medicine', 'Reg No: LT-DR-003')
+]
+
+SIGNATURE_LINES = ['Authorized Signature', 'LifeTrack Health Hub', 'Medical & Wellness Report', 'Digitally Verified Document']
+
+# Sections that never depend on the invoice; the HTML view renders them once per process
+STATIC_SECTIONS = ('header', 'prescription', 'doctors', 'signature')
+
+def build_sections(patient_name, invoice_number, invoice_date, height, weight, bmi, category, age=None, gender=None):
+    category_info = get_category_info(category)
+    risk_level = category_info.get('risk_level', 'N/A') if category_info else 'N/A'
+    classification = category_info.get('classification', 'N/A') if category_info else 'N/A'
+    # Under-20 readings are classified against CDC percentiles, not the WHO adult cutoffs
+    reference = reference_name(age)
+    protocol = 'World Health Organization (WHO) protocols' if reference == 'WHO Standards' \
+        else 'CDC BMI-for-age growth chart percentiles'
+
+    return [
+        {'key': 'header', 'clinic': CLINIC},
+        {'key': 'meta', 'report_id': invoice_number, 'date': invoice_date},
+        {'key': 'patient', 'title': 'PATIENT INFORMATION', 'rows': [
+            [('Patient Name', patient_name), ('Age', f"{age} yrs" if age else 'N/A')],
+            [('Gender', gender if gender and str(gender).strip() else 'Not Specified'), ('Visit Type', 'Wellness Assessment')]
+        ]},
+        {'key': 'measurements', 'title': 'ANTHROPOMETRIC MEASUREMENTS', 'rows': [
+            [('Height (cm)', f"{height} cm"), ('Weight (kg)', f"{weight} kg")],
+            [('BMI Reference', reference), ('Classification', classification)]
+        ]},
+        {'key': 'result', 'bmi': f"{bmi:.2f}", 'category': category.upper(),
+         'color': category_info['color'] if category_info else None},
+        {'key': 'interpretation', 'title': 'CLINICAL INTERPRETATION', 'parts': [
+            ('Based on the recorded Body Mass Index (BMI) of ', False), (f"{bmi:.2f}", True),
+            (', the patient is clinically classified as ', False), (category, True),
+            ('. This assessment indicates a ', False), (risk_level, True),
+            (f' risk level according to {protocol}. BMI is a specialized '
+             'screening tool used by healthcare professionals to evaluate body composition and related health risks.', False)
+        ]},
+        {'key': 'prescription', 'title': "DOCTOR'S WELLNESS PRESCRIPTION", 'items': PRESCRIPTION_ITEMS},
+        {'key': 'doctors', 'doctors': DOCTORS},
+        {'key': 'signature', 'lines': SIGNATURE_LINES}
+    ]
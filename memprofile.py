@@ -0,0 +1,202 @@
+import os
+import random
+import signal
+import threading
+import time
+import tracemalloc
+from collections import deque
+from functools import wraps
+
+try:
+    import resource
+except ImportError:  # not available on Windows; RSS is then read from /proc only
+    resource = None
+
+import metrics
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def current_rss_bytes():
+    # Resident set size right now. /proc/self/statm is one small read; elsewhere fall back to
+    # ru_maxrss, which is the high-water mark rather than the current value
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        if resource is None:
+            return 0
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if os.uname().sysname == 'Darwin' else maxrss * 1024
+
+def _site(stat):
+    frame = stat.traceback[0]
+    return f'{frame.filename}:{frame.lineno}'
+
+class MemoryProfiler:
+    # Opt-in allocation profiling for one worker process:
+    # - a sampled fraction of requests is bracketed by tracemalloc snapshots, and the top
+    #   allocation sites that grew during the request are kept in a short ring buffer
+    # - functions wrapped with profiled() record peak traced memory and RSS growth per call
+    # - dump() writes the top sites that grew since the baseline snapshot (admin endpoint, signal)
+    # - over_ceiling() tells the app when the worker should be recycled
+    # With enabled=False nothing is traced; RSS accounting and the ceiling still work.
+    def __init__(self, enabled=False, sample_rate=0.01, top=10, frames=1, dump_dir=None, ceiling_bytes=0, recent=20):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.top = top
+        self.frames = frames
+        self.dump_dir = dump_dir
+        self.ceiling_bytes = ceiling_bytes
+        self.recent_requests = deque(maxlen=recent)
+        self.render_stats = {}
+        self.baseline = None
+        self.baseline_time = None
+        self.recycle_requested = False
+        self._lock = threading.Lock()
+        self._signal_pid = None
+
+    def start(self):
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.reset_baseline()
+
+    def reset_baseline(self):
+        self.baseline = self.take_snapshot()
+        self.baseline_time = time.time()
+
+    def take_snapshot(self):
+        if not tracemalloc.is_tracing():
+            return None
+        # Leave out tracemalloc's own bookkeeping and the import machinery
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ))
+
+    def top_growth(self, snapshot, since, limit=None):
+        stats = snapshot.compare_to(since, 'lineno')
+        return [
+            {'site': _site(stat), 'size_diff': stat.size_diff, 'count_diff': stat.count_diff, 'size': stat.size}
+            for stat in stats[:limit or self.top] if stat.size_diff > 0
+        ]
+
+    def begin_request(self):
+        # Returns a snapshot to hand back to end_request(), or None when this request is not sampled
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        return self.take_snapshot()
+
+    def end_request(self, endpoint, before):
+        after = self.take_snapshot()
+        if before is None or after is None:
+            return None
+        sites = self.top_growth(after, before)
+        entry = {'endpoint': endpoint, 'time': time.time(), 'rss': current_rss_bytes(), 'sites': sites}
+        self.recent_requests.append(entry)
+        metrics.inc('memory_profiled_requests_total', endpoint=endpoint)
+        if sites:
+            print(f"DEBUG: Memory sample for {endpoint}: " +
+                  ', '.join(f"{site['site']} +{site['size_diff'] / 1024:.1f} KiB" for site in sites[:3]))
+        return entry
+
+    def profiled(self, kind):
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                rss_before = current_rss_bytes()
+                tracing = tracemalloc.is_tracing()
+                if tracing:
+                    # reset_peak is process-wide, so overlapping renders share one peak
+                    traced_before = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.reset_peak()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    peak = tracemalloc.get_traced_memory()[1] - traced_before if tracing else None
+                    self._record_render(kind, peak, current_rss_bytes() - rss_before)
+            return wrapper
+        return decorator
+
+    def _record_render(self, kind, peak, rss_growth):
+        with self._lock:
+            stats = self.render_stats.setdefault(kind, {'calls': 0, 'peak_bytes_max': 0, 'peak_bytes_total': 0,
+                                                         'rss_growth_bytes_total': 0})
+            stats['calls'] += 1
+            stats['rss_growth_bytes_total'] += max(rss_growth, 0)
+            if peak is not None:
+                stats['peak_bytes_total'] += peak
+                stats['peak_bytes_max'] = max(stats['peak_bytes_max'], peak)
+
+    def collect_metrics(self):
+        yield 'process_resident_memory_bytes', {}, current_rss_bytes()
+        if tracemalloc.is_tracing():
+            yield 'tracemalloc_traced_bytes', {}, tracemalloc.get_traced_memory()[0]
+        with self._lock:
+            items = [(kind, dict(stats)) for kind, stats in self.render_stats.items()]
+        for kind, stats in items:
+            yield 'memory_profiled_calls_total', {'kind': kind}, stats['calls']
+            yield 'memory_profiled_rss_growth_bytes_total', {'kind': kind}, stats['rss_growth_bytes_total']
+            if stats['peak_bytes_total']:
+                yield 'memory_profiled_peak_bytes_max', {'kind': kind}, stats['peak_bytes_max']
+                yield 'memory_profiled_peak_bytes_total', {'kind': kind}, stats['peak_bytes_total']
+
+    def diff_since_baseline(self, limit=None):
+        snapshot = self.take_snapshot()
+        if snapshot is None or self.baseline is None:
+            return None
+        return self.top_growth(snapshot, self.baseline, limit)
+
+    def report(self, limit=None):
+        traced = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else None
+        with self._lock:
+            render_stats = {kind: dict(stats) for kind, stats in self.render_stats.items()}
+        return {
+            'pid': os.getpid(),
+            'rss_bytes': current_rss_bytes(),
+            'ceiling_bytes': self.ceiling_bytes,
+            'tracing': traced is not None,
+            'traced_bytes': traced[0] if traced else None,
+            'traced_peak_bytes': traced[1] if traced else None,
+            'baseline_time': self.baseline_time,
+            'growth_since_baseline': self.diff_since_baseline(limit),
+            'renders': render_stats,
+            'recent_requests': list(self.recent_requests),
+        }
+
+    def dump(self, reason='manual'):
+        # Writes the top growth sites since the baseline to dump_dir; returns the file path
+        sites = self.diff_since_baseline(limit=max(self.top, 25))
+        os.makedirs(self.dump_dir, exist_ok=True)
+        path = os.path.join(self.dump_dir, f'memory-{os.getpid()}-{time.strftime("%Y%m%d-%H%M%S")}.txt')
+        with open(path, 'w') as f:
+            f.write(f'pid {os.getpid()} ({reason}), rss {current_rss_bytes() / 1048576:.1f} MiB\n')
+            if sites is None:
+                f.write('tracemalloc is not tracing; set MEMORY_PROFILING=1 to record allocation sites\n')
+            else:
+                f.write(f'growth since baseline taken at {time.ctime(self.baseline_time)}:\n')
+                for site in sites:
+                    f.write(f"{site['size_diff'] / 1024:10.1f} KiB {site['count_diff']:+8d} blocks  {site['site']}\n")
+        return path
+
+    def install_signal_handler(self, signum):
+        # Signal handlers can only be set from the main thread; callers retry from later hooks
+        if signum is None or self._signal_pid == os.getpid():
+            return False
+        try:
+            signal.signal(signum, lambda received, frame: print(f"DEBUG: Memory profile written to {self.dump('signal')}"))
+        except ValueError:
+            return False
+        self._signal_pid = os.getpid()
+        return True
+
+    def over_ceiling(self):
+        # Returns the RSS once it has crossed the ceiling, at most once per process
+        if not self.ceiling_bytes or self.recycle_requested:
+            return None
+        rss = current_rss_bytes()
+        if rss < self.ceiling_bytes:
+            return None
+        self.recycle_requested = True
+        return rss
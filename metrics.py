@@ -0,0 +1,30 @@
+import threading
+
+# Per-process counters, exposed in Prometheus text format by /api/metrics.
+# Under gunicorn every worker keeps its own numbers.
+_counters = {}
+_collectors = []
+_lock = threading.Lock()
+
+def inc(name, amount=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def register_collector(collect):
+    # collect() yields (name, labels dict, value) for values owned by other objects (caches, writers)
+    _collectors.append(collect)
+
+def samples():
+    with _lock:
+        items = [(name, dict(labels), value) for (name, labels), value in _counters.items()]
+    for collect in _collectors:
+        items.extend(collect())
+    return sorted(items, key=lambda item: (item[0], sorted(item[1].items())))
+
+def render_text():
+    lines = []
+    for name, labels, value in samples():
+        label_text = ','.join(f'{key}="{val}"' for key, val in sorted(labels.items()))
+        lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,67 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+# Hash method/cost in werkzeug notation, e.g. 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1'
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+# Processes doing the hashing for this worker; 0 hashes inline on the request thread
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+# In-flight hash jobs allowed per worker, and how long a request waits for a slot
+PASSWORD_HASH_CONCURRENCY = int(os.environ.get('PASSWORD_HASH_CONCURRENCY', 4))
+PASSWORD_HASH_WAIT = float(os.environ.get('PASSWORD_HASH_WAIT', 5))
+
+class HashingBusy(Exception):
+    pass
+
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_CONCURRENCY)
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor, _executor_pid
+    # Pools do not survive a fork, so each gunicorn worker builds its own
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+def _run(fn, *args):
+    if not _slots.acquire(timeout=PASSWORD_HASH_WAIT):
+        raise HashingBusy()
+    try:
+        if PASSWORD_HASH_WORKERS <= 0:
+            return fn(*args)
+        return _get_executor().submit(fn, *args).result()
+    finally:
+        _slots.release()
+
+def hash_password(password):
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def verify_password(pwhash, password):
+    return _run(check_password_hash, pwhash, password)
+
+def _prefix_for(method):
+    # The method part werkzeug writes before the first '$', with its defaults filled in
+    # (e.g. 'pbkdf2' -> 'pbkdf2:sha256:600000'); worked out from the string so no hash is computed
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = args if args else (2 ** 15, 8, 1)
+        return f'scrypt:{n}:{r}:{p}'
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    return method
+
+_method_prefix = _prefix_for(PASSWORD_HASH_METHOD)
+
+def needs_rehash(pwhash):
+    return pwhash.split('$', 1)[0] != _method_prefix
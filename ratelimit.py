@@ -0,0 +1,139 @@
+import math
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+class RateLimited(Exception):
+    def __init__(self, retry_after, endpoint_class, scope):
+        super().__init__(f'{endpoint_class} limit reached ({scope})')
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.endpoint_class = endpoint_class
+        self.scope = scope
+
+def parse_rate(value):
+    # '5/60' -> bucket of 5 tokens refilled at 5 per 60 seconds; '' or '0' disables the bucket
+    if not value or value.strip() in ('0', 'off'):
+        return None
+    count, _, seconds = value.partition('/')
+    count = float(count)
+    return count, count / float(seconds or 1)
+
+def _refill(tokens, updated, now, capacity, rate):
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+class MemoryBucketStore:
+    # Token buckets for this process only
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, buckets, cost=1.0):
+        # buckets: [(key, capacity, refill_per_second)]. Either every bucket pays `cost` or none
+        # does; returns (None, 0) or (key of the empty bucket, seconds until it has enough)
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key, capacity, rate in buckets:
+                tokens, updated = self._buckets.get(key, (capacity, now))
+                levels.append(_refill(tokens, updated, now, capacity, rate))
+            for (key, capacity, rate), tokens in zip(buckets, levels):
+                if tokens < cost:
+                    return key, (cost - tokens) / rate
+            for (key, capacity, rate), tokens in zip(buckets, levels):
+                self._buckets[key] = (tokens - cost, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return None, 0
+
+    def _prune(self, now):
+        # Buckets idle for an hour are full again (or close enough) and can be forgotten
+        for key in [key for key, (_, updated) in self._buckets.items() if now - updated > 3600]:
+            del self._buckets[key]
+
+class SQLiteBucketStore:
+    # Token buckets shared by every worker through a small SQLite file
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            self._local.db = db
+        return db
+
+    def take(self, buckets, cost=1.0):
+        db = self._connect()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            levels = []
+            for key, capacity, rate in buckets:
+                row = db.execute('SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?', (key,)).fetchone()
+                levels.append(_refill(row[0], row[1], now, capacity, rate) if row else capacity)
+            for (key, capacity, rate), tokens in zip(buckets, levels):
+                if tokens < cost:
+                    db.execute('COMMIT')
+                    return key, (cost - tokens) / rate
+            db.executemany('''
+                INSERT INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated
+            ''', [(key, tokens - cost, now) for (key, _, _), tokens in zip(buckets, levels)])
+            self._takes += 1
+            if self._takes % 1000 == 0:
+                db.execute('DELETE FROM rate_limit_buckets WHERE updated < ?', (now - 3600,))
+            db.execute('COMMIT')
+        except sqlite3.Error:
+            db.execute('ROLLBACK')
+            raise
+        return None, 0
+
+class RateLimiter:
+    # limits: {endpoint_class: {'user': (capacity, per_second) or None, 'global': ..., 'concurrency': n}}
+    def __init__(self, store, limits):
+        self.store = store
+        self.limits = limits
+        self._slots = {
+            endpoint_class: threading.BoundedSemaphore(limit['concurrency'])
+            for endpoint_class, limit in limits.items() if limit.get('concurrency')
+        }
+
+    @contextmanager
+    def admit(self, endpoint_class, user_id):
+        # Holds one of the class's concurrent slots for the duration of the block. Requests that
+        # find no slot or an empty bucket are turned away instead of queueing behind the renders.
+        limit = self.limits[endpoint_class]
+        slots = self._slots.get(endpoint_class)
+        if slots is not None and not slots.acquire(blocking=False):
+            metrics.inc('rate_limit_rejected_total', endpoint_class=endpoint_class, scope='concurrency')
+            raise RateLimited(1, endpoint_class, 'concurrency')
+        try:
+            buckets = []
+            if limit.get('user') and user_id is not None:
+                buckets.append((f'{endpoint_class}:user:{user_id}',) + limit['user'])
+            if limit.get('global'):
+                buckets.append((f'{endpoint_class}:global',) + limit['global'])
+            if self.store is not None and buckets:
+                key, retry_after = self.store.take(buckets)
+                if key is not None:
+                    scope = 'global' if key.endswith(':global') else 'user'
+                    metrics.inc('rate_limit_rejected_total', endpoint_class=endpoint_class, scope=scope)
+                    raise RateLimited(retry_after, endpoint_class, scope)
+            metrics.inc('rate_limit_admitted_total', endpoint_class=endpoint_class)
+            yield
+        finally:
+            if slots is not None:
+                slots.release()
@@ -0,0 +1,84 @@
+import hashlib
+import secrets
+import threading
+import time
+
+def token_digest(value):
+    # Only the SHA-256 of a reset token is stored. Lookups go through the unique index on the
+    # digest, so neither a leaked database nor response timing gives away a usable token.
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+def ensure_indexes(db):
+    # token is already UNIQUE (and so indexed); these cover the per-user cleanup and the purge
+    db.execute('CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_expires ON password_reset_tokens (expires_at)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_user ON password_reset_tokens (user_id)')
+
+def issue_token(db, user_id, now_ms, ttl_ms):
+    # Returns the raw token for the email link. Earlier unused links for the account stop
+    # working, so at most one row per user is live at a time.
+    token = secrets.token_urlsafe(32)
+    db.execute('DELETE FROM password_reset_tokens WHERE user_id = ?', (user_id,))
+    # expires_at holds epoch milliseconds, like the *_ms columns elsewhere
+    db.execute('INSERT INTO password_reset_tokens (user_id, token, expires_at) VALUES (?, ?, ?)',
+               (user_id, token_digest(token), now_ms + ttl_ms))
+    db.commit()
+    return token
+
+def find_valid(db, token, now_ms):
+    if not token:
+        return None
+    return db.execute('SELECT id, user_id FROM password_reset_tokens WHERE token = ? AND used = 0 AND expires_at > ?',
+                      (token_digest(token), now_ms)).fetchone()
+
+def consume(db, token, now_ms):
+    # Claims the token inside the caller's transaction; False when another request got there
+    # first or it expired in the meantime
+    cursor = db.execute('UPDATE password_reset_tokens SET used = 1 WHERE token = ? AND used = 0 AND expires_at > ?',
+                        (token_digest(token), now_ms))
+    return cursor.rowcount == 1
+
+def purge_expired(db, now_ms, batch_size=500, pause=0.01):
+    # Deletes expired tokens a batch at a time (range scan on idx_password_reset_tokens_expires) so
+    # signups and resets never wait long on the write lock. Used tokens are already deleted by the
+    # reset itself. Returns the number of rows removed.
+    removed = 0
+    while True:
+        cursor = db.execute('DELETE FROM password_reset_tokens WHERE id IN '
+                            '(SELECT id FROM password_reset_tokens WHERE expires_at <= ? LIMIT ?)',
+                            (now_ms, batch_size))
+        db.commit()
+        removed += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return removed
+        time.sleep(pause)
+
+class PurgeScheduler:
+    # Background thread running purge_expired every interval. Every worker may run one; a
+    # purge that finds nothing to delete costs a single index probe on expires_at.
+    def __init__(self, connect, now_ms, interval_minutes, batch_size=500):
+        self.connect = connect
+        self.now_ms = now_ms
+        self.interval = interval_minutes * 60
+        self.batch_size = batch_size
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return False
+        self._thread = threading.Thread(target=self._run, name='reset-token-purge', daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                db = self.connect()
+                try:
+                    removed = purge_expired(db, self.now_ms(), self.batch_size)
+                finally:
+                    db.close()
+                if removed:
+                    print(f"DEBUG: Purged {removed} password reset tokens")
+            except Exception as e:
+                print(f"DEBUG: Reset token purge failed: {e}")
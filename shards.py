@@ -0,0 +1,135 @@
+import glob
+import os
+import re
+import sqlite3
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Patient-owned tables; users and auth tables always stay on the primary (shard 0)
+SHARDED_TABLES = ('bmi_records', 'invoices')
+
+# Shard i allocates ids from i * ID_SPAN upwards, so ids stay unique across shards and
+# rows keep their id (and their /result/<id> URL) when they are moved to another shard
+ID_SPAN = 10 ** 12
+
+def shard_index(patient_id, count):
+    # crc32 rather than hash(): it must agree across processes and Python versions
+    if count <= 1 or patient_id is None:
+        return 0
+    return zlib.crc32(str(int(patient_id)).encode()) % count
+
+def shard_path(primary_path, index):
+    if index == 0:
+        return primary_path
+    root, ext = os.path.splitext(primary_path)
+    return f'{root}.shard{index}{ext}'
+
+def shard_paths(primary_path, count):
+    return [shard_path(primary_path, index) for index in range(max(count, 1))]
+
+def existing_shard_paths(primary_path):
+    # Every shard file on disk, including ones left over from a larger shard count
+    root, ext = os.path.splitext(primary_path)
+    found = [(0, primary_path)] if os.path.exists(primary_path) else []
+    pattern = re.compile(re.escape(root) + r'\.shard(\d+)' + re.escape(ext) + '$')
+    for path in glob.glob(f'{glob.escape(root)}.shard*{ext}'):
+        match = pattern.match(path)
+        if match:
+            found.append((int(match.group(1)), path))
+    return sorted(found)
+
+def seed_id_sequences(db, index):
+    # Called after the AUTOINCREMENT tables exist; only ever moves a sequence forward
+    floor = index * ID_SPAN
+    if floor == 0:
+        return
+    for table in SHARDED_TABLES:
+        row = db.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+        if row is None:
+            db.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, floor))
+        elif row[0] < floor:
+            db.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (floor, table))
+
+def fan_out(items, fn, connect, max_workers=None):
+    # Runs fn(db) against every shard and returns the results in shard order. Each thread
+    # opens its own connection; sqlite3 releases the GIL while a query runs.
+    def run(item):
+        db = connect(item)
+        try:
+            return fn(db)
+        finally:
+            db.close()
+
+    items = list(items)
+    if len(items) == 1:
+        return [run(items[0])]
+    with ThreadPoolExecutor(max_workers=max_workers or len(items)) as pool:
+        return list(pool.map(run, items))
+
+def _columns(db, schema, table):
+    return [row[1] for row in db.execute(f'PRAGMA {schema}.table_info({table})')]
+
+def _move_patients(db, patient_ids, target_index, renumber, stats):
+    # Copies the patients' readings and invoices into the attached `dest` shard and deletes
+    # them from this one, in a single transaction. Hot rows whose id belongs to a higher
+    # shard's range get a fresh id from the target (their invoices are pointed at it).
+    placeholders = ', '.join('?' * len(patient_ids))
+    limit = (target_index + 1) * ID_SPAN
+    new_record_ids = {}
+    try:
+        for table in SHARDED_TABLES:
+            columns = [column for column in _columns(db, 'main', table) if column in _columns(db, 'dest', table)]
+            column_list = ', '.join(columns)
+            insert = f'INSERT INTO dest.{table} ({column_list}) VALUES ({", ".join("?" * len(columns))})'
+            taken = {row[0] for row in db.execute(
+                f'SELECT id FROM dest.{table} WHERE id IN (SELECT id FROM main.{table} WHERE patient_id IN ({placeholders}))',
+                patient_ids
+            )}
+            rows = db.execute(f'SELECT {column_list} FROM main.{table} WHERE patient_id IN ({placeholders})', patient_ids).fetchall()
+            for row in rows:
+                row = list(row)
+                if table == 'invoices' and row[columns.index('record_id')] in new_record_ids:
+                    row[columns.index('record_id')] = new_record_ids[row[columns.index('record_id')]]
+                if row[0] in taken or (renumber and row[0] >= limit):
+                    old_id, row[0] = row[0], None
+                    new_id = db.execute(insert, row).lastrowid
+                    if table == 'bmi_records':
+                        new_record_ids[old_id] = new_id
+                    stats['renumbered'] += 1
+                else:
+                    db.execute(insert, row)
+            db.execute(f'DELETE FROM main.{table} WHERE patient_id IN ({placeholders})', patient_ids)
+            stats[table] += len(rows)
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+
+def rebalance(primary_path, count, batch_size=500, prepare=None, renumber=True):
+    # Moves every patient's rows onto shard_index(patient_id, count), draining shard files
+    # beyond `count` as well. prepare(path, index) must create the target schema.
+    # Run it with the app stopped: a write landing on the old shard mid-move would be left behind.
+    targets = shard_paths(primary_path, count)
+    for index, path in enumerate(targets):
+        if prepare:
+            prepare(path, index)
+    stats = {'bmi_records': 0, 'invoices': 0, 'renumbered': 0}
+
+    for source_index, source_path in existing_shard_paths(primary_path):
+        db = sqlite3.connect(source_path)
+        try:
+            moving = {}
+            for (patient_id,) in db.execute('SELECT patient_id FROM bmi_records UNION SELECT patient_id FROM invoices'):
+                target_index = shard_index(patient_id, count)
+                if target_index != source_index:
+                    moving.setdefault(target_index, []).append(patient_id)
+            for target_index, patient_ids in sorted(moving.items()):
+                db.execute('ATTACH DATABASE ? AS dest', (targets[target_index],))
+                try:
+                    for start in range(0, len(patient_ids), batch_size):
+                        _move_patients(db, patient_ids[start:start + batch_size], target_index, renumber, stats)
+                finally:
+                    db.execute('DETACH DATABASE dest')
+        finally:
+            db.close()
+    return stats
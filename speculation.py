@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import metrics
+
+class _Entry:
+    __slots__ = ('meta', 'future', 'created')
+
+    def __init__(self, meta, future, created):
+        self.meta = meta
+        self.future = future
+        self.created = created
+
+class SpeculativeRenderer:
+    # Renders files ahead of the request that is expected to need them. render() runs on a small
+    # background pool and returns a file path; the request that needs it claims the entry by key.
+    # Unclaimed entries expire after ttl_seconds or are evicted oldest-first past max_entries /
+    # max_bytes, and their files are deleted. Expiry is checked on every start(), claim() and
+    # metrics scrape, so idle workers do not keep stale files around.
+    def __init__(self, kind, workers=1, ttl_seconds=300, max_entries=64, max_bytes=32 * 1024 * 1024, wait_seconds=10):
+        self.kind = kind
+        self.workers = workers
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.wait = wait_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        metrics.register_collector(self._collect)
+
+    def _get_executor(self):
+        # Threads do not survive a fork, so each gunicorn worker starts its own pool
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f'speculative-{self.kind}')
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def _count(self, outcome):
+        metrics.inc('speculative_renders_total', kind=self.kind, outcome=outcome)
+
+    def start(self, key, meta, render):
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            if key in self._entries:
+                return False
+            self._entries[key] = _Entry(meta, self._get_executor().submit(render), now)
+            self._prune(now)
+        self._count('started')
+        return True
+
+    def claim(self, key, matches=None):
+        # Returns (meta, path) for a usable render, waiting for one still in progress; None otherwise
+        with self._lock:
+            self._prune(time.monotonic())
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            self._count('miss')
+            return None
+        if time.monotonic() - entry.created > self.ttl or (matches is not None and not matches(entry.meta)):
+            self._discard(entry, 'stale')
+            return None
+        waited = not entry.future.done()
+        try:
+            path = entry.future.result(timeout=self.wait)
+        except TimeoutError:
+            self._discard(entry, 'timeout')
+            return None
+        except Exception as e:
+            print(f"DEBUG: Speculative {self.kind} render failed: {e}")
+            self._count('failed')
+            return None
+        if not path or not os.path.exists(path):
+            self._count('failed')
+            return None
+        self._count('hit_waited' if waited else 'hit')
+        return entry.meta, path
+
+    def _discard(self, entry, outcome):
+        self._count(outcome)
+
+        def remove(future):
+            try:
+                path = future.result()
+                if path and os.path.exists(path):
+                    os.remove(path)
+            except Exception:
+                pass
+
+        entry.future.add_done_callback(remove)
+
+    def _entry_bytes(self, entry):
+        if not entry.future.done() or entry.future.exception() is not None:
+            return 0
+        path = entry.future.result()
+        return os.path.getsize(path) if path and os.path.exists(path) else 0
+
+    def _prune(self, now):
+        # Called with the lock held
+        for key in [key for key, entry in self._entries.items() if now - entry.created > self.ttl]:
+            self._discard(self._entries.pop(key), 'expired')
+        total = sum(self._entry_bytes(entry) for entry in self._entries.values())
+        while self._entries and (len(self._entries) > self.max_entries or total > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            total -= self._entry_bytes(entry)
+            self._discard(entry, 'evicted')
+
+    def _collect(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            entries = list(self._entries.values())
+        yield 'speculative_entries', {'kind': self.kind}, len(entries)
+        yield 'speculative_bytes', {'kind': self.kind}, sum(self._entry_bytes(entry) for entry in entries)
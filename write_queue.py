@@ -0,0 +1,95 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+# Coalesces small write transactions from many request threads into one commit.
+# Each job is a callable taking a sqlite3 connection. Jobs queued within max_delay_ms of
+# each other (up to max_batch) run in a single transaction, each inside its own savepoint
+# so a failing job only rolls back itself. Callers block on the returned future, so they
+# still get their own result (e.g. lastrowid) back synchronously.
+class GroupCommitWriter:
+    def __init__(self, database, max_batch=64, max_delay_ms=5, synchronous='FULL'):
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"synchronous must be one of {', '.join(SYNCHRONOUS_MODES)}")
+        self.database = database
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.synchronous = synchronous
+        self.batches = 0
+        self.jobs = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, job):
+        future = Future()
+        self._ensure_started()
+        self._queue.put((job, future))
+        return future
+
+    def run(self, job, timeout=30):
+        return self.submit(job).result(timeout)
+
+    def _ensure_started(self):
+        # Started lazily so gunicorn workers each get their own thread after fork
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='bmi-group-commit', daemon=True)
+                self._thread.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.database, isolation_level=None, check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        db.execute(f'PRAGMA synchronous = {self.synchronous}')
+        return db
+
+    def _run(self):
+        db = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(db, batch)
+
+    def _flush(self, db, batch):
+        outcomes = []
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            for job, future in batch:
+                db.execute('SAVEPOINT job')
+                try:
+                    outcomes.append((future, job(db), None))
+                    db.execute('RELEASE job')
+                except Exception as e:
+                    db.execute('ROLLBACK TO job')
+                    db.execute('RELEASE job')
+                    outcomes.append((future, None, e))
+            db.execute('COMMIT')
+        except Exception as e:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.jobs += len(batch)
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)